@@ -0,0 +1,388 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from Pipeline import ArticlePipeline, Stage
+import Metrics
+import Progress
+from Metrics import article_context
+from DocumentService import LocalDocument
+from SearchIndex import get_article_index
+from Summarize import summary_tags
+from OCR import classify_page, PAGE_SCAN, PAGE_TEXT, PAGE_IMAGE, PAGE_BLANK
+
+# Articles whose pages are fed to the OCR process pool at the same time
+OCR_ARTICLE_WORKERS = 2
+
+# Concurrent summary requests to the API across all articles
+SUMMARY_WORKERS = 4
+
+# Images above this resolution in saved articles are downsampled to it, 0 keeps them as they are
+OUTPUT_IMAGE_DPI = int(os.environ.get('OUTPUT_IMAGE_DPI', '0'))
+
+# Only images this much sharper than OUTPUT_IMAGE_DPI are resampled, and at this JPEG quality
+IMAGE_DPI_MARGIN = 1.2
+IMAGE_QUALITY = 80
+
+
+def output_folder_for(pdf_path):
+    """Create and return the output folder for an issue, named after the PDF file"""
+    # Get the directory and filename of the original PDF
+    pdf_dir = os.path.dirname(pdf_path)
+    pdf_filename = os.path.basename(pdf_path)
+    pdf_name_without_ext = os.path.splitext(pdf_filename)[0]
+
+    # Create the folder if it doesn't exist
+    output_folder = os.path.join(pdf_dir, pdf_name_without_ext)
+    os.makedirs(output_folder, exist_ok=True)
+    return output_folder
+
+
+def safe_filename(name):
+    """Clean the filename to avoid invalid characters"""
+    return ''.join(c if c.isalnum() or c in [' ', '-', '_'] else '_' for c in name)
+
+
+def save_pdf(doc, output_path, optimize=True, image_dpi=OUTPUT_IMAGE_DPI, plain_bytes=None):
+    """Write an article PDF and return fields for its 'save' metric.
+
+    Optimizing drops objects and resources the article's pages don't use,
+    compresses every stream, subsets the embedded fonts and, with image_dpi,
+    downsamples sharper images. The fields are bytes, the size written,
+    bytes_saved compared with plain_bytes, the size of a plain save of the
+    extracted pages, when it is known, and font_subset_error if the fonts
+    had to be kept whole.
+    """
+    fields = {}
+    if optimize:
+        if image_dpi:
+            doc.rewrite_images(dpi_threshold=int(image_dpi * IMAGE_DPI_MARGIN), dpi_target=image_dpi,
+                               quality=IMAGE_QUALITY)
+        try:
+            doc.subset_fonts()
+        except Exception as e:
+            fields['font_subset_error'] = str(e) or type(e).__name__
+        doc.save(output_path, garbage=4, clean=True, deflate=True,
+                 deflate_images=True, deflate_fonts=True)
+    else:
+        doc.save(output_path)
+    fields['bytes'] = os.path.getsize(output_path)
+    if plain_bytes is not None:
+        fields['bytes_saved'] = plain_bytes - fields['bytes']
+    return fields
+
+
+def make_job(article_id, article_data, source_path, output_dir, ocr):
+    """Build the job an article carries through the pipeline"""
+    return {
+        'article_id': article_id,
+        'article_data': article_data,
+        'source_path': source_path,
+        'output_dir': output_dir,
+        'ocr': ocr,
+    }
+
+
+class ArticleProcessor():
+    """The split -> OCR -> summarize steps for one article, without any UI.
+
+    report is called with the event dicts described in Progress ('status',
+    'progress', 'complete' and 'error') and must not block. open_source can hand out
+    an already open DocumentService for a path; when it returns None the
+    issue is opened in this process. Finished articles are added to
+    article_index, by default the shared SearchIndex. optimize and image_dpi
+    control how article PDFs are written, see save_pdf.
+    """
+
+    def __init__(self, report, ocr_pool, ai_summarize, open_source=None, article_index=None,
+                 optimize=True, image_dpi=OUTPUT_IMAGE_DPI):
+        self.report = report
+        self.ocr_pool = ocr_pool
+        self.ai_summarize = ai_summarize
+        self.open_source = open_source
+        self.article_index = article_index
+        self.optimize = optimize
+        self.image_dpi = image_dpi
+        self._documents = {}  # Source issues opened for splitting, by path
+        self._documents_lock = threading.Lock()
+        self._metrics = {}  # Output folder -> Metrics of that issue
+        self._metrics_lock = threading.Lock()
+
+    def create_pipeline(self, ocr_workers=OCR_ARTICLE_WORKERS, summary_workers=SUMMARY_WORKERS):
+        """Split, OCR and summarize each get their own bounded set of workers"""
+        return ArticlePipeline([
+            Stage("split", self.split_article, workers=1),
+            Stage("ocr", self.ocr_article, workers=ocr_workers),
+            Stage("summarize", self.summarize_article, workers=summary_workers),
+        ], on_error=self.on_pipeline_error)
+
+    def on_pipeline_error(self, article_id, job, error):
+        self.report({
+            'type': 'error',
+            'article_id': article_id,
+            'text': f"Failed to create PDF for '{job['article_data']['name']}': {error}"
+        })
+        self.metrics_for(job['output_dir']).write_summary()
+
+    def metrics_for(self, output_dir):
+        """The Metrics that collects timings for the issue written to output_dir"""
+        with self._metrics_lock:
+            metrics = self._metrics.get(output_dir)
+            if metrics is None:
+                metrics = Metrics.Metrics(output_dir, self.report)
+                self._metrics[output_dir] = metrics
+            return metrics
+
+    def drop_metrics(self, output_dir):
+        """Forget the timings of a finished issue; its metrics file is already written"""
+        with self._metrics_lock:
+            self._metrics.pop(output_dir, None)
+
+    @contextmanager
+    def _measure(self, job, stage):
+        """Time a whole stage and attribute everything recorded inside it to the article"""
+        metrics = self.metrics_for(job['output_dir'])
+        with article_context(metrics, job['article_id'], job['article_data']['name']):
+            with Metrics.span(stage):
+                yield
+
+    def _source_document(self, source_path):
+        if self.open_source:
+            document = self.open_source(source_path)
+            if document is not None:
+                return document
+
+        # Only the split stage uses these handles, never the viewer
+        with self._documents_lock:
+            document = self._documents.get(source_path)
+            if document is None:
+                document = LocalDocument(source_path)
+                self._documents[source_path] = document
+            return document
+
+    def close_source(self, source_path):
+        with self._documents_lock:
+            document = self._documents.pop(source_path, None)
+        if document is not None:
+            document.close()
+
+    def split_article(self, job):
+        """Pipeline stage: copy the article pages out of the magazine"""
+        with self._measure(job, 'split'):
+            return self._split_article(job)
+
+    def _split_article(self, job):
+        article_id = job['article_id']
+        article_data = job['article_data']
+        document = self._source_document(job['source_path'])
+
+        # Validate the article data
+        if not article_data["name"]:
+            self.report({
+                'type': 'error',
+                'article_id': article_id,
+                'text': "Please enter an article name."
+            })
+            return None
+
+        if article_data["start"] > article_data["end"]:
+            self.report({
+                'type': 'error',
+                'article_id': article_id,
+                'text': "Start page cannot be greater than end page."
+            })
+            return None
+
+        if article_data["start"] < 1 or article_data["end"] > len(document):
+            self.report({
+                'type': 'error',
+                'article_id': article_id,
+                'text': f"Pages must be between 1 and {len(document)}."
+            })
+            return None
+
+        # Create a new PDF with the selected pages in one copy
+        # PDF pages are 0-indexed, but our UI uses 1-indexed
+        new_pdf, job['plain_bytes'] = document.extract(article_data["start"] - 1,
+                                                       article_data["end"] - 1)
+
+        # Define output path
+        safe_name = safe_filename(article_data["name"])
+        job['safe_name'] = safe_name
+        job['output_path'] = os.path.join(job['output_dir'], f"{safe_name}.pdf")
+
+        # Update status
+        self.report({
+            'type': 'status',
+            'text': f"Processing: {safe_name}.pdf..."
+        })
+
+        if not job['ocr']:
+            # Keep the text layer for the summary, then save directly without OCR
+            with Metrics.span('extract_text', pages=len(new_pdf)):
+                job['pages_text'] = [page.get_text() for page in new_pdf]
+            self.save_article(new_pdf, job['output_path'], job['plain_bytes'])
+            new_pdf.close()
+        else:
+            # The OCR stage adds its text layer in memory and writes the file
+            job['document'] = new_pdf
+
+        return job
+
+    def ocr_article(self, job):
+        """Pipeline stage: add the OCR text layer if OCR is enabled"""
+        if not job['ocr']:
+            return job
+
+        with self._measure(job, 'ocr'):
+            return self._ocr_article(job)
+
+    def _ocr_article(self, job):
+        # Apply OCR and save to final destination
+        data = job['article_data']
+        job['pages_text'] = self.add_ocr_layer(
+            job.pop('document'), job['output_path'],
+            job['source_path'], range(data["start"] - 1, data["end"]), job.get('plain_bytes'))
+
+        return job
+
+    def summarize_article(self, job):
+        """Pipeline stage: create the AI summary and report completion"""
+        with self._measure(job, 'summarize'):
+            self._summarize_article(job)
+
+        self.report({
+            'type': 'complete',
+            'article_id': job['article_id']
+        })
+        self.metrics_for(job['output_dir']).write_summary()
+        return job
+
+    def _summarize_article(self, job):
+        safe_name = job['safe_name']
+
+        # Generate summary
+        self.report({
+            'type': 'status',
+            'text': f"Creating summary for: {safe_name}.pdf..."
+        })
+
+        # A resumed job no longer has the text from splitting
+        if job['pages_text'] is None:
+            job['pages_text'] = self.ai_summarize.extract_pages_from_pdf(job['output_path'])
+
+        # Call AI summarize for this specific article
+        summary = self.ai_summarize.summarize(job['output_path'], job['pages_text'])
+        self.index_article(job, summary)
+
+        # Signal completion
+        self.report({
+            'type': 'status',
+            'text': f"Completed: {safe_name}.pdf with summary"
+        })
+
+    def index_article(self, job, summary):
+        """Add the finished article to the full-text index; failing here doesn't fail the article"""
+        data = job['article_data']
+        # Tags from a manifest first, then the ones the summary ends with
+        tags = list(data.get("tags", ()))
+        tags += [tag for tag in summary_tags(summary) if tag.lower() not in map(str.lower, tags)]
+        try:
+            with Metrics.span('index'):
+                (self.article_index or get_article_index()).add_article(
+                    job['output_path'], job['source_path'], data["name"], data["start"], data["end"],
+                    '\n'.join(job['pages_text']), summary, tags)
+        except (sqlite3.Error, OSError) as e:
+            self.report({
+                'type': 'status',
+                'text': f"Could not add {job['safe_name']}.pdf to the search index: {e}"
+            })
+
+    def save_article(self, doc, output_path, plain_bytes=None):
+        """Write an article PDF and report how much the optimized save saved.
+
+        plain_bytes is the size of the extracted pages from DocumentService;
+        LocalDocument doesn't know it, so batch and hot folder runs report
+        only the size written.
+        """
+        with Metrics.span('save', optimize=self.optimize) as info:
+            info.update(save_pdf(doc, output_path, self.optimize, self.image_dpi, plain_bytes))
+
+        if self.optimize and 'bytes_saved' in info:
+            self.report({
+                'type': 'status',
+                'text': (f"Saved {os.path.basename(output_path)}: {info['bytes'] / 1e6:.1f} MB, "
+                         f"{info['bytes_saved'] / 1e6:.1f} MB smaller than a plain save")
+            })
+
+        if 'font_subset_error' in info:
+            self.report({
+                'type': 'status',
+                'text': (f"Kept the fonts of {os.path.basename(output_path)} whole, "
+                         f"subsetting failed: {info['font_subset_error']}")
+            })
+
+    def add_ocr_layer(self, doc, output_path, source_path, source_pages, plain_bytes=None):
+        """Add an OCR layer to an in-memory PDF and save it.
+
+        The pages of doc are copies of source_pages in the PDF at
+        source_path. Pages that need OCR are processed in parallel by the
+        worker processes; pages with a text layer, images and blanks are skipped.
+        Returns the text of every page, from OCR or from the existing text layer.
+        """
+        self.report({
+            'type': 'status',
+            'text': "Applying OCR to PDF (this may take a while)..."
+        })
+
+        # Only pages without a text layer that look like printed text need OCR
+        with Metrics.span('classify', pages=len(doc)):
+            page_classes = [classify_page(page) for page in doc]
+        source_pages = list(source_pages)
+        scan_positions = [i for i, page_class in enumerate(page_classes)
+                          if page_class == PAGE_SCAN]
+
+        def report_progress(done, total):
+            self.report(Progress.progress('ocr', done, total,
+                                          text=f"Applying OCR: page {done}/{total}"))
+
+        # Extract text using OCR, returned in page order
+        scanned = self.ocr_pool.ocr_pages(
+            source_path, [source_pages[i] for i in scan_positions],
+            progress=report_progress)
+        texts = [''] * len(page_classes)
+        for i, text in zip(scan_positions, scanned):
+            texts[i] = text
+
+        # Pages that already carry text keep it, but it still goes to the summary
+        pages_text = list(texts)
+        for i, page_class in enumerate(page_classes):
+            if page_class == PAGE_TEXT:
+                pages_text[i] = doc[i].get_text()
+
+        import fitz  # PyMuPDF
+        for i, text in enumerate(texts):
+            # Add OCR text layer
+            if text:
+                doc[i].insert_text(
+                    fitz.Point(0, 0),  # Insert at top-left
+                    text,
+                    fontsize=0.1,      # Very small font (invisible)
+                    color=(0, 0, 0, 0)  # Transparent color
+                )
+
+        # Save the OCR'd PDF
+        self.save_article(doc, output_path, plain_bytes)
+        doc.close()
+
+        skipped = len(page_classes) - len(scan_positions)
+        self.report({
+            'type': 'status',
+            'text': (f"OCR complete, skipped {skipped}/{len(page_classes)} pages "
+                     f"({page_classes.count(PAGE_TEXT)} with text, "
+                     f"{page_classes.count(PAGE_IMAGE)} images, "
+                     f"{page_classes.count(PAGE_BLANK)} blank). PDF saved to {output_path}")
+        })
+
+        return pages_text
+
@@ -0,0 +1,137 @@
+"""Split, OCR and summarize a magazine issue from a manifest, without the Tk window.
+
+Usage:
+    python BatchSplit.py issue.pdf articles.json
+    python BatchSplit.py issue.pdf articles.csv --no-ocr --summary-workers 2
+
+The manifest lists the articles as {name, start, end} with 1-indexed pages,
+either as a JSON list or as a CSV file with a name,start,end header. An
+optional tags field (a list, or words separated by commas) is stored in the
+search index.
+"""
+import argparse
+import csv
+import json
+import os
+import queue
+import sys
+from Summarize import AISummarize
+from OCR import OcrPool
+from ArticleProcessor import (ArticleProcessor, make_job, output_folder_for,
+                              OCR_ARTICLE_WORKERS, SUMMARY_WORKERS, OUTPUT_IMAGE_DPI)
+
+
+def load_manifest(manifest_path):
+    """Read the article list from a JSON or CSV manifest"""
+    with open(manifest_path, newline='', encoding='utf-8') as file:
+        if manifest_path.lower().endswith('.csv'):
+            rows = list(csv.DictReader(file))
+        else:
+            rows = json.load(file)
+            if isinstance(rows, dict):
+                rows = rows.get('articles', [])
+
+    articles = []
+    for row in rows:
+        article = {
+            "name": str(row["name"]).strip(),
+            "start": int(row["start"]),
+            "end": int(row["end"])
+        }
+        tags = row.get("tags")
+        if isinstance(tags, str):
+            tags = tags.split(',')
+        if tags:
+            article["tags"] = [str(tag).strip() for tag in tags if str(tag).strip()]
+        articles.append(article)
+    return articles
+
+
+def run(pdf_path, articles, output_dir=None, ocr=True,
+        ocr_workers=OCR_ARTICLE_WORKERS, summary_workers=SUMMARY_WORKERS,
+        ocr_processes=None, optimize=True, image_dpi=OUTPUT_IMAGE_DPI, log=print):
+    """Process every article and return the names of the ones that failed"""
+    messages = queue.Queue()
+    output_dir = output_dir or output_folder_for(pdf_path)
+    os.makedirs(output_dir, exist_ok=True)
+
+    ocr_pool = OcrPool(ocr_processes)
+    processor = ArticleProcessor(messages.put, ocr_pool,
+                                 AISummarize(lambda text: messages.put({'type': 'status', 'text': text})),
+                                 optimize=optimize, image_dpi=image_dpi)
+    pipeline = processor.create_pipeline(ocr_workers, summary_workers)
+
+    for article_id, article_data in enumerate(articles):
+        pipeline.submit(article_id, make_job(article_id, article_data, pdf_path, output_dir, ocr))
+
+    # Print progress until every article has completed or failed
+    remaining = set(range(len(articles)))
+    failed = []
+    try:
+        while remaining:
+            message = messages.get()
+            if message['type'] in ('status', 'progress'):
+                log(message['text'])
+            elif message['type'] == 'complete':
+                remaining.discard(message['article_id'])
+                log(f"[{len(articles) - len(remaining)}/{len(articles)}] "
+                    f"Done: {articles[message['article_id']]['name']}")
+            elif message['type'] == 'error':
+                remaining.discard(message['article_id'])
+                failed.append(articles[message['article_id']]['name'])
+                log(f"Error: {message['text']}")
+    finally:
+        ocr_pool.shutdown()
+        processor.close_source(pdf_path)
+
+    log(processor.metrics_for(output_dir).summary_table())
+    return failed
+
+
+def add_processing_arguments(parser):
+    """Options shared with HotFolder for how articles are processed and saved"""
+    parser.add_argument('--no-ocr', action='store_true', help="Don't add an OCR text layer")
+    parser.add_argument('--ocr-workers', type=int, default=OCR_ARTICLE_WORKERS,
+                        help="Articles being OCR'd at the same time")
+    parser.add_argument('--ocr-processes', type=int, default=None,
+                        help="OCR worker processes (default: one per core)")
+    parser.add_argument('--summary-workers', type=int, default=SUMMARY_WORKERS,
+                        help="Articles being summarized at the same time")
+    parser.add_argument('--no-optimize', action='store_true',
+                        help="Save articles as copied, without removing unused objects or subsetting fonts")
+    parser.add_argument('--image-dpi', type=int, default=OUTPUT_IMAGE_DPI,
+                        help="Downsample sharper images in the articles to this DPI (default: keep)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Split a magazine PDF into summarized articles.")
+    parser.add_argument('pdf', help="Magazine issue PDF")
+    parser.add_argument('manifest', help="JSON or CSV list of articles with name, start and end")
+    parser.add_argument('--output', help="Output folder (default: folder named after the PDF)")
+    add_processing_arguments(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        articles = load_manifest(args.manifest)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"Could not read manifest: {e}", file=sys.stderr)
+        return 2
+
+    if not articles:
+        print("The manifest has no articles.", file=sys.stderr)
+        return 2
+
+    failed = run(args.pdf, articles, args.output, not args.no_ocr,
+                 args.ocr_workers, args.summary_workers, args.ocr_processes,
+                 not args.no_optimize, args.image_dpi)
+
+    if failed:
+        print(f"{len(failed)} of {len(articles)} articles failed: {', '.join(failed)}", file=sys.stderr)
+        return 1
+
+    print(f"All {len(articles)} articles completed.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
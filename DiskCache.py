@@ -0,0 +1,129 @@
+import os
+import hashlib
+import tempfile
+import threading
+
+# Root folder for all persistent caches, override with MAGAZINE_SPLITTER_CACHE
+CACHE_ROOT = os.environ.get(
+    'MAGAZINE_SPLITTER_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'MagazineSplitter'))
+
+_file_hashes = {}
+_file_hashes_lock = threading.Lock()
+
+
+def file_hash(path):
+    """Return the SHA-256 of a file's contents, remembered while the file is unchanged"""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _file_hashes_lock:
+        digest = _file_hashes.get(key)
+    if digest:
+        return digest
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            sha.update(block)
+    digest = sha.hexdigest()
+
+    with _file_hashes_lock:
+        _file_hashes[key] = digest
+    return digest
+
+
+class DiskCache():
+    """Content-addressed cache of small files with a total size limit.
+
+    Entries are evicted least recently used first once the folder grows past
+    max_bytes. Writes are atomic, so a crash never leaves a partial entry.
+    """
+
+    def __init__(self, name, max_bytes=512 * 1024 * 1024, root=None):
+        self.directory = os.path.join(root or CACHE_ROOT, name)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = None  # Measured lazily on the first write
+
+    @staticmethod
+    def key(*parts):
+        """Build a cache key from any number of printable parts"""
+        return hashlib.sha256('\x1f'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except OSError:
+            return None
+
+        # Mark as recently used for eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        existing = os.path.getsize(path) if os.path.exists(path) else 0
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._measure()
+            else:
+                self._total_bytes += len(data) - existing
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def get_text(self, key):
+        data = self.get(key)
+        return data.decode('utf-8') if data is not None else None
+
+    def put_text(self, key, text):
+        self.put(key, text.encode('utf-8'))
+
+    def _entries(self):
+        for dir_path, _, file_names in os.walk(self.directory):
+            for file_name in file_names:
+                if file_name.endswith('.tmp'):
+                    continue
+                path = os.path.join(dir_path, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat
+
+    def _measure(self):
+        return sum(stat.st_size for _, stat in self._entries())
+
+    def _evict(self):
+        """Delete the least recently used entries until we are 10% under the limit"""
+        target = self.max_bytes * 0.9
+        entries = sorted(self._entries(), key=lambda entry: entry[1].st_mtime)
+        total = sum(stat.st_size for _, stat in entries)
+        for path, stat in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+                total -= stat.st_size
+            except OSError:
+                pass
+        self._total_bytes = total
@@ -0,0 +1,235 @@
+import multiprocessing
+import queue
+import threading
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+# Shared buffer per worker for pixmaps; 64 MB fits a 4600 x 4600 RGB render
+PIXMAP_BUFFER_BYTES = 64 * 1024 * 1024
+
+# Worker processes per open issue, so the viewer can render while an article is extracted
+SERVICE_WORKERS = 2
+
+
+def _serve(pdf_path, connection, buffer_name):
+    """Child process: answer render and extract requests on its own handle of the issue"""
+    import fitz  # PyMuPDF
+    from PageCache import render_pixmap
+    from PageIndex import compute_features
+
+    buffer = shared_memory.SharedMemory(name=buffer_name)
+    try:
+        document, open_error = fitz.open(pdf_path), None
+    except Exception as e:
+        # Not a PDF or unreadable: answer every request with why, instead of dying mid-reply
+        document, open_error = None, f"Could not open {pdf_path}: {e}"
+    try:
+        while True:
+            request = connection.recv()
+            command = request[0]
+            if command == 'close':
+                break
+
+            try:
+                if open_error:
+                    connection.send(('error', open_error))
+
+                elif command == 'render':
+                    _, page_index, width, height = request
+                    pix = render_pixmap(document, page_index, width, height)
+                    size = len(pix.samples)
+                    if size <= buffer.size:
+                        # The pixels go through shared memory, only the size through the pipe
+                        buffer.buf[:size] = pix.samples
+                        connection.send(('shm', pix.width, pix.height))
+                    else:
+                        connection.send(('bytes', pix.width, pix.height, pix.samples))
+
+                elif command == 'extract':
+                    _, from_page, to_page = request
+                    article = fitz.open()
+                    article.insert_pdf(document, from_page=from_page, to_page=to_page)
+                    connection.send(('pdf', article.tobytes()))
+                    article.close()
+
+                elif command == 'features':
+                    _, start, stop = request
+                    connection.send(('features', compute_features(document, start, stop)))
+
+                elif command == 'page_count':
+                    connection.send(('count', len(document)))
+
+                else:
+                    connection.send(('error', f"Unknown command: {command}"))
+            except Exception as e:
+                connection.send(('error', str(e)))
+    finally:
+        buffer.close()
+        if document is not None:
+            document.close()
+
+
+class _Worker():
+    """One child process with a pipe and the shared buffer it renders into"""
+
+    def __init__(self, context, pdf_path):
+        self.buffer = shared_memory.SharedMemory(create=True, size=PIXMAP_BUFFER_BYTES)
+        try:
+            self.connection, child_connection = context.Pipe()
+            self.process = context.Process(
+                target=_serve, args=(pdf_path, child_connection, self.buffer.name), daemon=True)
+            self.process.start()
+        except Exception:
+            self.buffer.close()
+            self.buffer.unlink()
+            raise
+        child_connection.close()
+
+    def request(self, *message):
+        try:
+            self.connection.send(message)
+            reply = self.connection.recv()
+        except (EOFError, OSError) as e:
+            raise RuntimeError(f"The document worker stopped: {e or type(e).__name__}")
+        if reply[0] == 'error':
+            raise RuntimeError(reply[1])
+        return reply
+
+    def close(self):
+        try:
+            self.connection.send(('close',))
+        except OSError:
+            pass
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.connection.close()
+        self.buffer.close()
+        self.buffer.unlink()
+
+
+class DocumentService():
+    """MuPDF work for one issue, done in child processes with their own handles.
+
+    The Tk thread, the prefetcher and the split stage all go through this
+    service instead of sharing a fitz document in the GUI process. Requests
+    are spread over idle workers; each worker handles one request at a time.
+    """
+
+    def __init__(self, pdf_path, workers=SERVICE_WORKERS):
+        self.pdf_path = pdf_path
+        # spawn, because forking a process that runs Tk and worker threads is unsafe
+        context = multiprocessing.get_context('spawn')
+        self._workers = []
+        self._idle = queue.Queue()
+        self._closed = threading.Event()
+        try:
+            for _ in range(max(1, workers)):
+                worker = _Worker(context, pdf_path)
+                self._workers.append(worker)
+                self._idle.put(worker)
+            self.page_count = self._call('page_count')[1]
+            self.concurrency = len(self._workers)  # Requests that can run at the same time
+        except Exception:
+            # Don't leave child processes or shared buffers behind for a file that won't open
+            self.close()
+            raise
+
+    @contextmanager
+    def _checkout(self):
+        """Borrow an idle worker for one request"""
+        if self._closed.is_set():
+            raise RuntimeError("The document service is closed.")
+        worker = self._idle.get()
+        try:
+            yield worker
+        finally:
+            self._idle.put(worker)
+
+    def _call(self, *message):
+        with self._checkout() as worker:
+            return worker.request(*message)
+
+    def __len__(self):
+        return self.page_count
+
+    def __bool__(self):
+        return True
+
+    def render(self, page_index, width, height):
+        """Render a page to a PIL image that fits inside width x height"""
+        from PIL import Image
+
+        with self._checkout() as worker:
+            reply = worker.request('render', page_index, width, height)
+            if reply[0] == 'shm':
+                _, pixel_width, pixel_height = reply
+                size = pixel_width * pixel_height * 3
+                # Copy out of the buffer before the worker is free to reuse it
+                return Image.frombytes("RGB", (pixel_width, pixel_height),
+                                       bytes(worker.buffer.buf[:size]))
+            _, pixel_width, pixel_height, samples = reply
+            return Image.frombytes("RGB", (pixel_width, pixel_height), samples)
+
+    def extract(self, from_page, to_page):
+        """Return (new in-memory fitz document with pages from_page..to_page (0-indexed), its size).
+
+        The worker already serializes the pages to send them, so the size of
+        a plain save of the article comes for free.
+        """
+        import fitz  # PyMuPDF
+        _, data = self._call('extract', from_page, to_page)
+        return fitz.open("pdf", data), len(data)
+
+    def features(self, start, stop):
+        """Layout features of pages start..stop-1, see PageIndex"""
+        return self._call('features', start, stop)[1]
+
+    def close(self):
+        self._closed.set()
+        # Wait for requests in flight so no worker is closed mid-reply
+        for _ in self._workers:
+            self._idle.get()
+        for worker in self._workers:
+            worker.close()
+
+
+class LocalDocument():
+    """The same interface as DocumentService on a handle in this process, for headless runs"""
+
+    def __init__(self, pdf_path):
+        import fitz  # PyMuPDF
+        self.pdf_path = pdf_path
+        self.document = fitz.open(pdf_path)
+        self.page_count = len(self.document)
+        self.concurrency = 1
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.page_count
+
+    def __bool__(self):
+        return True
+
+    def render(self, page_index, width, height):
+        from PageCache import render_page
+        with self._lock:
+            return render_page(self.document, page_index, width, height)
+
+    def extract(self, from_page, to_page):
+        """Like DocumentService.extract, but the size is None: finding it would mean serializing
+        the article an extra time"""
+        import fitz  # PyMuPDF
+        article = fitz.open()
+        with self._lock:
+            article.insert_pdf(self.document, from_page=from_page, to_page=to_page)
+        return article, None
+
+    def features(self, start, stop):
+        from PageIndex import compute_features
+        with self._lock:
+            return compute_features(self.document, start, stop)
+
+    def close(self):
+        with self._lock:
+            self.document.close()
@@ -0,0 +1,217 @@
+import io
+import queue
+import tkinter as tk
+from tkinter.ttk import Scrollbar
+from DiskCache import DiskCache, file_hash
+from PageCache import BackgroundRenderer
+
+# Thumbnails fit inside this box, A4 proportions
+THUMBNAIL_WIDTH = 90
+THUMBNAIL_HEIGHT = 127
+
+# Vertical space per page: thumbnail, page number and padding
+SLOT_HEIGHT = THUMBNAIL_HEIGHT + 24
+
+# Pages above and below the visible ones that are kept ready while scrolling
+VISIBLE_MARGIN = 2
+
+# How often finished thumbnails are put on the canvas
+POLL_MS = 50
+
+# JPEG thumbnails of every issue opened, keyed by the hash of the PDF
+thumbnail_cache = DiskCache('thumbnails', max_bytes=128 * 1024 * 1024)
+
+
+class ThumbnailRenderer(BackgroundRenderer):
+    """Background thread that loads thumbnails from the disk cache or renders the missing ones.
+
+    render is called as render(page_index, width, height), e.g.
+    DocumentService.render. Finished (page_index, PIL image) pairs are put
+    on results for the Tk thread to pick up.
+    """
+
+    def __init__(self, pdf_path, render, width=THUMBNAIL_WIDTH, height=THUMBNAIL_HEIGHT):
+        self.pdf_path = pdf_path
+        self.render = render
+        self.width = width
+        self.height = height
+        self.results = queue.Queue()
+        # Hashing a big issue takes a moment, so it happens on this thread and not on open
+        self._pdf_hash = None
+        super().__init__()
+
+    def request(self, page_indices):
+        """Replace pending work with these pages, in order"""
+        self._replace_pending(page_indices)
+
+    def process(self, page_index):
+        if self._pdf_hash is None:
+            self._pdf_hash = file_hash(self.pdf_path)
+        self.results.put((page_index, self._thumbnail(self._pdf_hash, page_index)))
+
+    def _thumbnail(self, pdf_hash, page_index):
+        from PIL import Image
+
+        key = DiskCache.key('thumbnail', pdf_hash, page_index, self.width, self.height)
+        data = thumbnail_cache.get(key)
+        if data is not None:
+            img = Image.open(io.BytesIO(data))
+            img.load()
+            return img
+
+        img = self.render(page_index, self.width, self.height)
+        buffer = io.BytesIO()
+        img.save(buffer, 'JPEG', quality=80)
+        thumbnail_cache.put(key, buffer.getvalue())
+        return img
+
+
+class Filmstrip(tk.Frame):
+    """Scrollable column of page thumbnails; clicking one calls on_select(page_index).
+
+    Only the pages in view (plus VISIBLE_MARGIN) have canvas items and
+    images, so memory stays the same for 10 or 500 pages.
+    """
+
+    def __init__(self, parent, on_select=None):
+        super().__init__(parent)
+        self.on_select = on_select
+        self.page_count = 0
+        self.current_page = 0
+        self.renderer = None
+        self._photos = {}  # Page index -> PhotoImage of pages in view
+        self._drawn = set()  # Pages in view with a placeholder or thumbnail on the canvas
+        self._update_job = None
+
+        self.canvas = tk.Canvas(self, width=THUMBNAIL_WIDTH + 16, bd=1, relief=tk.SUNKEN,
+                                bg="gray", highlightthickness=0, yscrollincrement=SLOT_HEIGHT)
+        self.canvas.pack(side=tk.LEFT, fill=tk.Y, expand=True)
+        self.scrollbar = Scrollbar(self, orient="vertical", command=self.canvas.yview)
+        self.scrollbar.pack(side=tk.LEFT, fill=tk.Y)
+        self.canvas.configure(yscrollcommand=self.on_scroll)
+
+        self.canvas.bind("<Configure>", lambda event: self.schedule_update())
+        self.canvas.bind("<Button-1>", self.on_click)
+        self.canvas.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.canvas.bind("<Button-4>", lambda event: self.canvas.yview_scroll(-1, "units"))
+        self.canvas.bind("<Button-5>", lambda event: self.canvas.yview_scroll(1, "units"))
+
+        self.poll_results()
+
+    def load(self, pdf_path, page_count, render):
+        """Show the pages of a newly opened issue"""
+        if self.renderer:
+            self.renderer.stop()
+        self.canvas.delete("all")
+        self._photos.clear()
+        self._drawn.clear()
+
+        self.page_count = page_count
+        self.current_page = 0
+        self.renderer = ThumbnailRenderer(pdf_path, render)
+        self.canvas.configure(scrollregion=(0, 0, THUMBNAIL_WIDTH + 16, page_count * SLOT_HEIGHT))
+        self.canvas.yview_moveto(0)
+        self.schedule_update()
+
+    def on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self.schedule_update()
+
+    def on_mouse_wheel(self, event):
+        self.canvas.yview_scroll(-1 if event.delta > 0 else 1, "units")
+
+    def on_click(self, event):
+        page_index = int(self.canvas.canvasy(event.y) // SLOT_HEIGHT)
+        if self.on_select and 0 <= page_index < self.page_count:
+            self.on_select(page_index)
+
+    def schedule_update(self):
+        """Redraw once after a burst of scroll and resize events"""
+        if self._update_job is None:
+            self._update_job = self.after_idle(self.update_visible)
+
+    def visible_pages(self):
+        top = self.canvas.canvasy(0)
+        bottom = self.canvas.canvasy(self.canvas.winfo_height())
+        first = max(0, int(top // SLOT_HEIGHT) - VISIBLE_MARGIN)
+        last = min(self.page_count - 1, int(bottom // SLOT_HEIGHT) + VISIBLE_MARGIN)
+        return range(first, last + 1)
+
+    def update_visible(self):
+        self._update_job = None
+        if not self.renderer:
+            return
+
+        visible = self.visible_pages()
+
+        # Forget the pages that scrolled out of view
+        for page_index in self._drawn - set(visible):
+            self.canvas.delete(f"page{page_index}")
+            self._photos.pop(page_index, None)
+        self._drawn &= set(visible)
+
+        for page_index in visible:
+            if page_index not in self._drawn:
+                self.draw_placeholder(page_index)
+        self.draw_current()
+
+        # Only the pages in view are rendered, nearest to the top first
+        self.renderer.request([page_index for page_index in visible
+                               if page_index not in self._photos])
+
+    def draw_placeholder(self, page_index):
+        x = 8 + THUMBNAIL_WIDTH // 2
+        y = page_index * SLOT_HEIGHT + 4
+        tag = f"page{page_index}"
+        self.canvas.create_rectangle(8, y, 8 + THUMBNAIL_WIDTH, y + THUMBNAIL_HEIGHT,
+                                     fill="white", outline="", tags=(tag, f"{tag}_placeholder"))
+        self.canvas.create_text(x, y + THUMBNAIL_HEIGHT + 10, text=str(page_index + 1), tags=tag)
+        self._drawn.add(page_index)
+
+    def draw_current(self):
+        """Frame the thumbnail of the page shown in the viewer"""
+        self.canvas.delete("current")
+        y = self.current_page * SLOT_HEIGHT + 4
+        self.canvas.create_rectangle(6, y - 2, 10 + THUMBNAIL_WIDTH, y + THUMBNAIL_HEIGHT + 2,
+                                     outline="orange", width=3, tags="current")
+
+    def set_current(self, page_index):
+        """Highlight the viewer's page and scroll it into view"""
+        self.current_page = page_index
+        if not self.page_count:
+            return
+
+        top = self.canvas.canvasy(0)
+        bottom = self.canvas.canvasy(self.canvas.winfo_height())
+        y = page_index * SLOT_HEIGHT
+        if y < top or y + SLOT_HEIGHT > bottom:
+            self.canvas.yview_moveto(y / (self.page_count * SLOT_HEIGHT))
+        self.draw_current()
+
+    def poll_results(self):
+        """Put finished thumbnails on the canvas, dropping the ones no longer in view"""
+        if self.renderer:
+            from PIL import ImageTk
+            while True:
+                try:
+                    page_index, img = self.renderer.results.get_nowait()
+                except queue.Empty:
+                    break
+                if page_index not in self._drawn or page_index in self._photos:
+                    continue
+
+                photo = ImageTk.PhotoImage(img)
+                self._photos[page_index] = photo
+                tag = f"page{page_index}"
+                self.canvas.delete(f"{tag}_placeholder")
+                self.canvas.create_image(8 + THUMBNAIL_WIDTH // 2,
+                                         page_index * SLOT_HEIGHT + 4 + THUMBNAIL_HEIGHT // 2,
+                                         image=photo, tags=tag)
+            self.canvas.tag_raise("current")
+
+        self.after(POLL_MS, self.poll_results)
+
+    def close(self):
+        if self.renderer:
+            self.renderer.stop()
+            self.renderer = None
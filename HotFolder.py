@@ -0,0 +1,378 @@
+"""Watch a drop folder for magazine issues and process them unattended.
+
+Usage:
+    python HotFolder.py /path/to/drop
+    python HotFolder.py /path/to/drop --no-ocr --retry-failed
+
+Every issue is a PDF plus a manifest with the same name (issue.pdf with
+issue.json or issue.csv, see BatchSplit.py for the format). Output goes to the
+folder named after the PDF, next to it, just like in the window. Progress of
+every article is recorded in a SQLite journal so a restarted watcher resumes
+where it stopped instead of redoing finished articles. Saving a changed
+manifest for a journaled issue queues the articles that changed; finished
+articles that are still listed unchanged are kept.
+"""
+import argparse
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from Summarize import AISummarize
+from OCR import OcrPool
+from DiskCache import file_hash
+from Pipeline import ArticlePipeline, Stage
+from ArticleProcessor import (ArticleProcessor, make_job, output_folder_for, safe_filename,
+                              OCR_ARTICLE_WORKERS, SUMMARY_WORKERS, OUTPUT_IMAGE_DPI)
+from BatchSplit import add_processing_arguments, load_manifest
+
+JOURNAL_NAME = '.magazine_splitter_journal.sqlite'
+
+# Seconds between scans of the drop folder
+POLL_SECONDS = 5
+
+# Files must be unchanged this long before we pick them up, so copies can finish
+SETTLE_SECONDS = 10
+
+# Article states, in pipeline order
+QUEUED = 'queued'
+SPLIT = 'split'
+OCR_DONE = 'ocr_done'
+SUMMARY_DONE = 'summary_done'
+FAILED = 'failed'
+
+MANIFEST_EXTENSIONS = ('.json', '.csv')
+
+
+class JobJournal():
+    """Crash-safe record of issues and the state of each of their articles"""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=FULL')
+        with self._connection:
+            self._connection.executescript('''
+                CREATE TABLE IF NOT EXISTS issues (
+                    id INTEGER PRIMARY KEY,
+                    pdf_path TEXT NOT NULL,
+                    pdf_hash TEXT NOT NULL,
+                    manifest_path TEXT NOT NULL,
+                    output_dir TEXT NOT NULL,
+                    added_at REAL NOT NULL,
+                    manifest_hash TEXT NOT NULL DEFAULT '',
+                    UNIQUE (pdf_path, pdf_hash)
+                );
+                CREATE TABLE IF NOT EXISTS articles (
+                    id INTEGER PRIMARY KEY,
+                    issue_id INTEGER NOT NULL REFERENCES issues(id),
+                    position INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    start_page INTEGER NOT NULL,
+                    end_page INTEGER NOT NULL,
+                    state TEXT NOT NULL,
+                    output_path TEXT,
+                    error TEXT,
+                    updated_at REAL NOT NULL,
+                    tags TEXT NOT NULL DEFAULT ''
+                );
+                CREATE INDEX IF NOT EXISTS articles_state ON articles (state);
+            ''')
+            # Journals written before tags and manifest hashes were recorded
+            for table, column in (('articles', 'tags'), ('issues', 'manifest_hash')):
+                columns = [row[1] for row in self._connection.execute(f'PRAGMA table_info({table})')]
+                if column not in columns:
+                    self._connection.execute(
+                        f"ALTER TABLE {table} ADD COLUMN {column} TEXT NOT NULL DEFAULT ''")
+
+    def find_issue(self, pdf_path, pdf_hash):
+        """Return (issue id, hash of the manifest it was queued from), or None for a new issue"""
+        with self._lock:
+            return self._connection.execute(
+                'SELECT id, manifest_hash FROM issues WHERE pdf_path = ? AND pdf_hash = ?',
+                (pdf_path, pdf_hash)).fetchone()
+
+    def _insert_article(self, issue_id, position, article, now):
+        self._connection.execute(
+            'INSERT INTO articles (issue_id, position, name, start_page, end_page, state, '
+            'updated_at, tags) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (issue_id, position, article["name"], article["start"], article["end"], QUEUED, now,
+             ','.join(article.get("tags", ()))))
+
+    def add_issue(self, pdf_path, pdf_hash, manifest_path, manifest_hash, output_dir, articles):
+        """Record an issue and its articles in one transaction and return the issue id"""
+        now = time.time()
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                'INSERT INTO issues (pdf_path, pdf_hash, manifest_path, manifest_hash, output_dir, '
+                'added_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (pdf_path, pdf_hash, manifest_path, manifest_hash, output_dir, now))
+            issue_id = cursor.lastrowid
+            for position, article in enumerate(articles):
+                self._insert_article(issue_id, position, article, now)
+        return issue_id
+
+    def update_issue(self, issue_id, manifest_path, manifest_hash, articles):
+        """Make an issue's articles match a changed manifest and return the ids of the removed ones.
+
+        Articles listed with the same name, pages and tags as before keep their
+        state, so finished ones aren't redone; the others are added as queued.
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            existing = {}  # (name, start, end, tags) -> ids of journaled articles
+            for row in self._connection.execute(
+                    'SELECT id, name, start_page, end_page, tags FROM articles WHERE issue_id = ? '
+                    'ORDER BY position', (issue_id,)):
+                existing.setdefault(row[1:], []).append(row[0])
+
+            for position, article in enumerate(articles):
+                key = (article["name"], article["start"], article["end"], ','.join(article.get("tags", ())))
+                if existing.get(key):
+                    self._connection.execute('UPDATE articles SET position = ? WHERE id = ?',
+                                             (position, existing[key].pop(0)))
+                else:
+                    self._insert_article(issue_id, position, article, now)
+
+            removed = [article_id for ids in existing.values() for article_id in ids]
+            self._connection.executemany('DELETE FROM articles WHERE id = ?',
+                                         [(article_id,) for article_id in removed])
+            self._connection.execute(
+                'UPDATE issues SET manifest_path = ?, manifest_hash = ? WHERE id = ?',
+                (manifest_path, manifest_hash, issue_id))
+        return removed
+
+    def set_state(self, article_id, state, output_path=None, error=None):
+        with self._lock, self._connection:
+            self._connection.execute(
+                'UPDATE articles SET state = ?, output_path = COALESCE(?, output_path), '
+                'error = ?, updated_at = ? WHERE id = ?',
+                (state, output_path, error, time.time(), article_id))
+
+    def unfinished_articles(self, include_failed=False):
+        """Articles still to do, oldest issue first"""
+        states = [QUEUED, SPLIT, OCR_DONE] + ([FAILED] if include_failed else [])
+        placeholders = ', '.join('?' * len(states))
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT a.id, a.issue_id, a.name, a.start_page, a.end_page, a.state, a.output_path, '
+                'a.tags, i.pdf_path, i.output_dir FROM articles a JOIN issues i ON a.issue_id = i.id '
+                f'WHERE a.state IN ({placeholders}) ORDER BY a.issue_id, a.position',
+                states).fetchall()
+        return [dict(zip(('id', 'issue_id', 'name', 'start', 'end', 'state', 'output_path',
+                          'tags', 'pdf_path', 'output_dir'), row)) for row in rows]
+
+    def issue_progress(self, issue_id):
+        """Return (finished, failed, total) article counts for an issue"""
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT state, COUNT(*) FROM articles WHERE issue_id = ? GROUP BY state',
+                (issue_id,)).fetchall()
+        counts = dict(rows)
+        return counts.get(SUMMARY_DONE, 0), counts.get(FAILED, 0), sum(counts.values())
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class HotFolder():
+    """Scan a drop folder, queue new issues and journal every article's progress"""
+
+    def __init__(self, drop_dir, journal_path=None, ocr=True,
+                 ocr_workers=OCR_ARTICLE_WORKERS, summary_workers=SUMMARY_WORKERS,
+                 ocr_processes=None, optimize=True, image_dpi=OUTPUT_IMAGE_DPI, log=print):
+        self.drop_dir = os.path.abspath(drop_dir)
+        self.ocr = ocr
+        self.log = log
+        self.journal = JobJournal(journal_path or os.path.join(self.drop_dir, JOURNAL_NAME))
+        self.messages = queue.Queue()
+        self.ocr_pool = OcrPool(ocr_processes)
+        self.processor = ArticleProcessor(
+            self.messages.put, self.ocr_pool,
+            AISummarize(lambda text: self.messages.put({'type': 'status', 'text': text})),
+            optimize=optimize, image_dpi=image_dpi)
+
+        # Same stages as the window and BatchSplit, with the journal updated after each one
+        self.pipeline = ArticlePipeline([
+            Stage("split", self._journaled(self.processor.split_article, SPLIT), workers=1),
+            Stage("ocr", self._journaled(self.processor.ocr_article, OCR_DONE), workers=ocr_workers),
+            Stage("summarize", self.processor.summarize_article, workers=summary_workers),
+        ], on_error=self.processor.on_pipeline_error)
+        self._issue_of = {}  # Article id -> issue id for articles in the pipeline
+        self._output_dir_of = {}  # Issue id -> output folder
+        self._pdf_path_of = {}  # Issue id -> source PDF
+        self._rejected_manifests = set()  # (path, mtime) of manifests that could not be read
+
+    def _journaled(self, stage_func, state):
+        def run(job):
+            result = stage_func(job)
+            if result is not None:
+                self.journal.set_state(job['article_id'], state, output_path=job.get('output_path'))
+            return result
+        return run
+
+    def _submit(self, article, issue_id, pdf_path, output_dir):
+        data = {"name": article["name"], "start": article["start"], "end": article["end"]}
+        if article.get("tags"):
+            data["tags"] = article["tags"].split(',')
+        job = make_job(article["id"], data, pdf_path, output_dir, self.ocr)
+        self._issue_of[article["id"]] = issue_id
+        self._output_dir_of[issue_id] = output_dir
+        self._pdf_path_of[issue_id] = pdf_path
+
+        output_path = article.get("output_path")
+        if article.get("state") == OCR_DONE and output_path and os.path.exists(output_path):
+            # The article PDF is already written, only the summary is missing
+            job['safe_name'] = safe_filename(data["name"])
+            job['output_path'] = output_path
+            job['pages_text'] = None
+            self.pipeline.submit(article["id"], job, priority=issue_id, stage=2)
+        else:
+            # The split result only lives in memory, so anything earlier starts over
+            self.pipeline.submit(article["id"], job, priority=issue_id)
+
+    def resume(self, include_failed=False):
+        """Queue the articles a previous run left unfinished"""
+        articles = [article for article in self.journal.unfinished_articles(include_failed)
+                    if article["id"] not in self._issue_of]
+        for article in articles:
+            self._submit(article, article["issue_id"], article["pdf_path"], article["output_dir"])
+        if articles:
+            self.log(f"Resuming {len(articles)} unfinished articles")
+
+    def _queue_issue(self, issue_id, pdf_path, output_dir):
+        """Submit the unfinished articles of an issue that aren't in the pipeline yet"""
+        queued = 0
+        for article in self.journal.unfinished_articles():
+            if article["issue_id"] == issue_id and article["id"] not in self._issue_of:
+                self._submit(article, issue_id, pdf_path, output_dir)
+                queued += 1
+        return queued
+
+    def _is_settled(self, path):
+        return time.time() - os.path.getmtime(path) >= SETTLE_SECONDS
+
+    def scan(self):
+        """Queue every issue in the drop folder that is new or whose manifest changed"""
+        for entry in sorted(os.scandir(self.drop_dir), key=lambda entry: entry.name):
+            if not entry.is_file() or not entry.name.lower().endswith('.pdf'):
+                continue
+
+            stem = os.path.splitext(entry.path)[0]
+            manifests = [stem + ext for ext in MANIFEST_EXTENSIONS if os.path.exists(stem + ext)]
+            if not manifests:
+                continue
+            manifest_path = manifests[0]
+
+            try:
+                if not (self._is_settled(entry.path) and self._is_settled(manifest_path)):
+                    continue
+                manifest_key = (manifest_path, os.path.getmtime(manifest_path))
+                if manifest_key in self._rejected_manifests:
+                    continue
+                pdf_hash = file_hash(entry.path)
+                manifest_hash = file_hash(manifest_path)
+                issue = self.journal.find_issue(entry.path, pdf_hash)
+                if issue and issue[1] == manifest_hash:
+                    continue
+                try:
+                    articles = load_manifest(manifest_path)
+                except (OSError, ValueError, KeyError, TypeError):
+                    # Not read again until it changes, so the problem is logged once
+                    self._rejected_manifests.add(manifest_key)
+                    raise
+                output_dir = output_folder_for(entry.path)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                self.log(f"Skipping {entry.name}: {e}")
+                continue
+
+            if issue is None:
+                issue_id = self.journal.add_issue(entry.path, pdf_hash, manifest_path, manifest_hash,
+                                                  output_dir, articles)
+                self._queue_issue(issue_id, entry.path, output_dir)
+                self.log(f"Queued {len(articles)} articles from {entry.name}")
+                continue
+
+            issue_id = issue[0]
+            removed = self.journal.update_issue(issue_id, manifest_path, manifest_hash, articles)
+            for article_id in removed:
+                # Articles no longer in the manifest stop at their next stage
+                self.pipeline.cancel(article_id)
+                self._issue_of.pop(article_id, None)
+            queued = self._queue_issue(issue_id, entry.path, output_dir)
+            self.log(f"Manifest of {entry.name} changed: {len(removed)} articles removed, {queued} queued")
+
+    def _handle(self, message):
+        if message['type'] in ('status', 'progress'):
+            self.log(message['text'])
+            return
+        if message['type'] not in ('complete', 'error'):
+            return
+
+        article_id = message['article_id']
+        if message['type'] == 'complete':
+            self.journal.set_state(article_id, SUMMARY_DONE)
+        elif message['type'] == 'error':
+            self.journal.set_state(article_id, FAILED, error=message['text'])
+            self.log(f"Error: {message['text']}")
+
+        issue_id = self._issue_of.pop(article_id, None)
+        if issue_id is not None:
+            finished, failed, total = self.journal.issue_progress(issue_id)
+            if finished + failed == total:
+                self.log(f"Issue {issue_id} finished: {finished} done, {failed} failed")
+                output_dir = self._output_dir_of.pop(issue_id, None)
+                if output_dir:
+                    self.log(self.processor.metrics_for(output_dir).summary_table())
+                    self.processor.drop_metrics(output_dir)
+                # A watcher runs for days, so finished issues must not keep their PDF open
+                pdf_path = self._pdf_path_of.pop(issue_id, None)
+                if pdf_path:
+                    self.processor.close_source(pdf_path)
+
+    def run(self, retry_failed=False):
+        # Scan first, so articles of manifests edited while stopped aren't resumed as they were
+        self.scan()
+        self.resume(retry_failed)
+        next_scan = time.monotonic() + POLL_SECONDS
+        try:
+            while True:
+                if time.monotonic() >= next_scan:
+                    self.scan()
+                    next_scan = time.monotonic() + POLL_SECONDS
+                try:
+                    self._handle(self.messages.get(timeout=1))
+                except queue.Empty:
+                    pass
+        finally:
+            self.ocr_pool.shutdown()
+            self.journal.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Process magazine issues dropped into a folder.")
+    parser.add_argument('drop_dir', help="Folder to watch for issue PDFs and their manifests")
+    parser.add_argument('--journal', help=f"Journal database (default: {JOURNAL_NAME} in the drop folder)")
+    parser.add_argument('--retry-failed', action='store_true', help="Queue failed articles again on start")
+    add_processing_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.drop_dir):
+        print(f"Not a folder: {args.drop_dir}", file=sys.stderr)
+        return 2
+
+    hot_folder = HotFolder(args.drop_dir, args.journal, not args.no_ocr,
+                           args.ocr_workers, args.summary_workers, args.ocr_processes,
+                           not args.no_optimize, args.image_dpi)
+    try:
+        hot_folder.run(args.retry_failed)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
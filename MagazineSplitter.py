@@ -2,14 +2,27 @@ import tkinter as tk
 from tkinter import filedialog, messagebox
 from tkinter.ttk import Frame, Button, Label, Entry, Scrollbar, Checkbutton
 import os
-import fitz  # PyMuPDF
-from PIL import Image, ImageTk
-import io
-import pytesseract
-import tempfile
 import threading
-import queue
+import time
 from Summarize import AISummarize
+import Progress
+from Progress import ProgressBus
+from PageCache import PageCache, PagePrefetcher
+from DocumentService import DocumentService
+from Filmstrip import Filmstrip
+from PageIndex import index_document, propose_articles
+from OCR import OcrPool, perform_ocr
+from ArticleProcessor import ArticleProcessor, make_job, output_folder_for
+
+# Delay before redrawing the page once the window stops resizing
+RESIZE_DEBOUNCE_MS = 150
+
+# How often worker progress is drawn, about 20 frames a second
+PROGRESS_FRAME_MS = 50
+
+# Pipeline priorities, lower runs first
+INTERACTIVE_PRIORITY = 0
+BATCH_PRIORITY = 1
 
 
 class ArticleEntry(Frame):
@@ -130,6 +143,11 @@ class ArticleEntry(Frame):
         self.set_start_btn.config(state='disabled')
         self.set_end_btn.config(state='disabled')
 
+    def show_progress(self, event):
+        """Show how far the current stage of this article has got"""
+        self.status_label.config(text=f"{event['stage'].upper()} {event['done']}/{event['total']}",
+                                 foreground="orange")
+
     def mark_as_failed(self):
         """Mark this article as failed"""
         self.status_label.config(text="✗ Failed", foreground="red")
@@ -156,17 +174,37 @@ class MagazineSplitter(tk.Tk):
         self.next_article_id = 0
         self.pdf_path = None  # Store the original PDF path for auto-folder creation
 
+        # Issues replaced in the viewer stay open until the articles queued from them are done
+        self.retired_documents = {}  # PDF path -> DocumentService
+        self.source_jobs = {}  # PDF path -> ids of the articles queued from it
+
+        # Rendered page images and the background renderer for neighbouring pages
+        self.page_cache = PageCache()
+        self.prefetcher = None
+        self.resize_job = None  # Pending debounced redraw after a resize
+
         # OCR option
         self.ocr_enabled = tk.BooleanVar(value=True)
 
         self.setup_ui()
 
-        self.ai_summarize = AISummarize(self.set_status)
-        
-        # Queue for background thread communication
-        self.task_queue = queue.Queue()
+        # Workers publish here without waiting for the window; process_queue draws the latest state
+        self.progress_bus = ProgressBus()
+
+        self.ai_summarize = AISummarize(self.progress_bus.publish_status)
+
+        # Page OCR runs in worker processes shared by all articles
+        self.ocr_pool = OcrPool()
+
+        # Articles go through the split -> OCR -> summarize pipeline
+        self.processor = ArticleProcessor(self.progress_bus.publish, self.ocr_pool, self.ai_summarize,
+                                          open_source=self.open_source)
+        self.pipeline = self.processor.create_pipeline()
         self.process_queue()
 
+        # Stop the worker processes and free their shared buffers with the window
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
     def setup_ui(self):
         # Top frame for buttons
         top_frame = tk.Frame(self)
@@ -196,6 +234,10 @@ class MagazineSplitter(tk.Tk):
         content_frame = tk.Frame(self)
         content_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
 
+        # Page thumbnails (far left) to jump straight to a page
+        self.filmstrip = Filmstrip(content_frame, on_select=self.go_to_page)
+        self.filmstrip.pack(side=tk.LEFT, fill=tk.Y, padx=(0, 10))
+
         # PDF viewer frame (left side) - adjusted width
         viewer_frame = tk.Frame(content_frame, width=750)
         viewer_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
@@ -219,6 +261,7 @@ class MagazineSplitter(tk.Tk):
         self.canvas = tk.Canvas(
             viewer_frame, bd=1, relief=tk.SUNKEN, bg="gray")
         self.canvas.pack(fill=tk.BOTH, expand=True)
+        self.canvas.bind("<Configure>", self.on_viewer_configure)
 
         # Article list frame (right side) - made significantly wider
         self.article_frame = tk.Frame(content_frame, width=800)  # Increased from 650 to 800
@@ -267,35 +310,71 @@ class MagazineSplitter(tk.Tk):
         canvas_width = event.width
         self.articles_canvas.itemconfig("self.articles_container", width=canvas_width)
 
+    def on_viewer_configure(self, event):
+        """Coalesce resize events so only the final canvas size gets rendered"""
+        if not self.pdf_document:
+            return
+
+        if self.resize_job:
+            self.after_cancel(self.resize_job)
+        self.resize_job = self.after(RESIZE_DEBOUNCE_MS, self._redraw_after_resize)
+
+    def _redraw_after_resize(self):
+        self.resize_job = None
+        self.update_page_display()
+
     def process_queue(self):
-        """Process messages from background threads"""
-        try:
-            while True:
-                message = self.task_queue.get_nowait()
-                if message['type'] == 'status':
-                    self.set_status(message['text'])
-                elif message['type'] == 'complete':
-                    article_id = message['article_id']
-                    if article_id in self.articles:
-                        self.articles[article_id].mark_as_generated()
-                elif message['type'] == 'error':
-                    article_id = message['article_id']
-                    if article_id in self.articles:
-                        self.articles[article_id].mark_as_failed()
-                    messagebox.showerror("Error", message['text'])
-        except queue.Empty:
-            pass
-        
-        # Schedule next check
-        self.after(100, self.process_queue)
+        """Draw the latest state published by background threads, once per frame"""
+        status_text = None
+        for message in self.progress_bus.drain():
+            article_id = message['article_id']
+            if message['type'] == Progress.STATUS:
+                status_text = message['text']
+            elif message['type'] == Progress.PROGRESS:
+                status_text = message['text']
+                if article_id in self.articles and not self.articles[article_id].is_generated:
+                    self.articles[article_id].show_progress(message)
+            elif message['type'] == Progress.COMPLETE:
+                if article_id in self.articles:
+                    self.articles[article_id].mark_as_generated()
+            elif message['type'] == Progress.ERROR:
+                if article_id in self.articles:
+                    self.articles[article_id].mark_as_failed()
+                messagebox.showerror("Error", message['text'])
+            elif message['type'] == Progress.PROPOSALS:
+                self.apply_proposals(message)
+
+        # Only the newest line is shown, so only it is drawn
+        if status_text is not None:
+            self.set_status(status_text)
+
+        if self.retired_documents:
+            self.release_documents()
+
+        # Schedule next frame
+        self.after(PROGRESS_FRAME_MS, self.process_queue)
 
     def set_status(self, status_message):
+        """Tk thread only; background threads publish to progress_bus instead"""
         self.status_var.set(status_message)
-        self.update()
 
     def thread_safe_status(self, status_message):
         """Thread-safe status update"""
-        self.task_queue.put({'type': 'status', 'text': status_message})
+        self.progress_bus.publish_status(status_message)
+
+    def on_close(self):
+        """Close the issue's document service and the OCR pool, then the window"""
+        if self.prefetcher:
+            self.prefetcher.stop()
+        self.filmstrip.close()
+        if self.pdf_document:
+            self.pdf_document.close()
+            self.pdf_document = None
+        for document in self.retired_documents.values():
+            document.close()
+        self.retired_documents.clear()
+        self.ocr_pool.shutdown()
+        self.destroy()
 
     def on_frame_configure(self, event=None):
         """Reset the scroll region to encompass the inner frame"""
@@ -309,9 +388,25 @@ class MagazineSplitter(tk.Tk):
 
         if file_path:
             try:
-                self.pdf_document = fitz.open(file_path)
+                # MuPDF runs in worker processes, so a slow page never blocks the window
+                document = DocumentService(file_path)
+                if self.prefetcher:
+                    self.prefetcher.stop()
+                if self.pdf_document:
+                    self.retire_document(self.pdf_path, self.pdf_document)
+                self.pdf_document = document
                 self.pdf_path = file_path  # Store the original PDF path
                 self.current_page = 0
+
+                # Start with an empty cache and a prefetcher bound to the new file
+                self.page_cache = PageCache()
+                self.prefetcher = PagePrefetcher(document.render, self.page_cache)
+                self.filmstrip.load(file_path, len(document), document.render)
+
+                # Suggest the article boundaries without holding up the first page
+                threading.Thread(target=self.index_issue, args=(file_path, document),
+                                 daemon=True).start()
+
                 self.status_var.set(f"Opened: {os.path.basename(file_path)}")
                 self.update_page_display()
                 self.page_label.config(
@@ -325,23 +420,69 @@ class MagazineSplitter(tk.Tk):
             except Exception as e:
                 messagebox.showerror("Error", f"Could not open PDF: {e}")
 
+    def open_source(self, source_path):
+        """Let the split stage extract through the open document's worker processes"""
+        document = self.pdf_document
+        if document and document.pdf_path == source_path:
+            return document
+        return self.retired_documents.get(source_path)
+
+    def retire_document(self, pdf_path, document):
+        """Keep a document the viewer no longer shows for the articles still queued from it"""
+        previous = self.retired_documents.pop(pdf_path, None)
+        if previous:
+            threading.Thread(target=previous.close, daemon=True).start()
+        self.retired_documents[pdf_path] = document
+        self.release_documents()
+
+    def release_documents(self):
+        """Close the retired documents whose articles have all left the pipeline"""
+        for pdf_path, document in list(self.retired_documents.items()):
+            active = {article_id for article_id in self.source_jobs.get(pdf_path, ())
+                      if self.pipeline.is_active(article_id)}
+            if active:
+                self.source_jobs[pdf_path] = active
+                continue
+            self.source_jobs.pop(pdf_path, None)
+            del self.retired_documents[pdf_path]
+            # Closing waits for requests in flight, which must not hold up the window
+            threading.Thread(target=document.close, daemon=True).start()
+
+    def index_issue(self, pdf_path, document):
+        """Worker thread: compute the page features and publish the proposed articles"""
+        start = time.perf_counter()
+        try:
+            articles = propose_articles(index_document(pdf_path, document))
+        except Exception as e:
+            if self.pdf_document is document:
+                self.progress_bus.publish_status(f"Could not suggest articles: {e}")
+            return
+
+        self.progress_bus.publish({
+            'type': Progress.PROPOSALS,
+            'pdf_path': pdf_path,
+            'articles': articles,
+            'seconds': time.perf_counter() - start
+        })
+
+    def apply_proposals(self, message):
+        """Pre-fill the article list with the proposed articles, unless it already has entries"""
+        if message['pdf_path'] != self.pdf_path or self.articles:
+            return
+
+        for article in message['articles']:
+            self.add_article(article["name"], article["start"], article["end"])
+        self.articles_canvas.yview_moveto(0)
+        self.set_status(f"Suggested {len(message['articles'])} articles "
+                        f"in {message['seconds']:.2f}s, check the names and pages before generating")
+
     def create_output_folder(self):
         """Create output folder based on PDF filename"""
         if not self.pdf_path:
             return None
         
-        # Get the directory and filename of the original PDF
-        pdf_dir = os.path.dirname(self.pdf_path)
-        pdf_filename = os.path.basename(self.pdf_path)
-        pdf_name_without_ext = os.path.splitext(pdf_filename)[0]
-        
-        # Create folder path
-        output_folder = os.path.join(pdf_dir, pdf_name_without_ext)
-        
-        # Create the folder if it doesn't exist
         try:
-            os.makedirs(output_folder, exist_ok=True)
-            return output_folder
+            return output_folder_for(self.pdf_path)
         except Exception as e:
             messagebox.showerror("Error", f"Could not create output folder: {e}")
             return None
@@ -350,27 +491,16 @@ class MagazineSplitter(tk.Tk):
         if not self.pdf_document:
             return
 
-        # Get the page
-        page = self.pdf_document[self.current_page]
-
-        # Render the page to an image
-        pix = page.get_pixmap(matrix=fitz.Matrix(1.5, 1.5))
-        img_data = pix.tobytes("ppm")  # Convert to PPM format
-
-        # Convert to PIL Image and then to PhotoImage for tkinter
-        img = Image.open(io.BytesIO(img_data))
-
-        # Resize to fit the canvas if necessary
         canvas_width = self.canvas.winfo_width()
         canvas_height = self.canvas.winfo_height()
 
-        if canvas_width > 1 and canvas_height > 1:  # Ensure canvas has been drawn
-            img_width, img_height = img.size
-            scale = min(canvas_width / img_width, canvas_height / img_height)
-            new_width = int(img_width * scale)
-            new_height = int(img_height * scale)
-            img = img.resize((new_width, new_height), Image.LANCZOS)
+        # Reuse a cached render for this page and size if we have one
+        img = self.page_cache.get(self.current_page, canvas_width, canvas_height)
+        if img is None:
+            img = self.pdf_document.render(self.current_page, canvas_width, canvas_height)
+            self.page_cache.put(self.current_page, canvas_width, canvas_height, img)
 
+        from PIL import ImageTk
         self.photo_image = ImageTk.PhotoImage(img)
 
         # Clear canvas and display the image
@@ -384,6 +514,12 @@ class MagazineSplitter(tk.Tk):
         # Update page counter
         self.page_label.config(
             text=f"Page: {self.current_page + 1}/{len(self.pdf_document)}")
+        self.filmstrip.set_current(self.current_page)
+
+        # Render the surrounding pages in the background
+        if self.prefetcher:
+            self.prefetcher.request(self.current_page, len(self.pdf_document),
+                                    canvas_width, canvas_height)
 
     def next_page(self):
         if self.pdf_document and self.current_page < len(self.pdf_document) - 1:
@@ -395,11 +531,16 @@ class MagazineSplitter(tk.Tk):
             self.current_page -= 1
             self.update_page_display()
 
+    def go_to_page(self, page_index):
+        if self.pdf_document and 0 <= page_index < len(self.pdf_document):
+            self.current_page = page_index
+            self.update_page_display()
+
     def get_current_page_number(self):
         # Return 1-indexed page number for UI consistency
         return self.current_page + 1
 
-    def add_article(self):
+    def add_article(self, name="", start_page=None, end_page=None):
         if not self.pdf_document:
             messagebox.showwarning(
                 "Warning", "Please open a PDF document first.")
@@ -413,9 +554,9 @@ class MagazineSplitter(tk.Tk):
         article_entry = ArticleEntry(
             self.articles_container,
             article_id,
-            name="",
-            start_page=current_page,
-            end_page=current_page,
+            name=name,
+            start_page=start_page or current_page,
+            end_page=end_page or current_page,
             current_page_callback=self.get_current_page_number,
             delete_callback=self.delete_article,
             max_pages=len(self.pdf_document),
@@ -434,6 +575,9 @@ class MagazineSplitter(tk.Tk):
         self.articles_canvas.yview_moveto(1.0)
 
     def delete_article(self, article_id):
+        # Don't spend OCR or API time on an article that no longer exists
+        self.pipeline.cancel(article_id)
+
         if article_id in self.articles:
             self.articles[article_id].destroy()
             del self.articles[article_id]
@@ -444,7 +588,7 @@ class MagazineSplitter(tk.Tk):
                 scrollregion=self.articles_canvas.bbox("all"))
 
     def generate_single_article(self, article_id, article_data):
-        """Generate a single article PDF and summary in background thread"""
+        """Queue a single article for PDF generation and summary"""
         if not self.pdf_document:
             messagebox.showwarning("Warning", "No PDF document loaded.")
             return False
@@ -454,154 +598,20 @@ class MagazineSplitter(tk.Tk):
         if not output_dir:
             return False
 
-        # Start background thread
-        thread = threading.Thread(
-            target=self._generate_article_thread,
-            args=(article_id, article_data, output_dir),
-            daemon=True
-        )
-        thread.start()
+        # Articles finished by hand jump ahead of batch work
+        self.queue_article(article_id, article_data, output_dir, INTERACTIVE_PRIORITY)
 
-    def _generate_article_thread(self, article_id, article_data, output_dir):
-        """Background thread function to generate article"""
-        try:
-            # Validate the article data
-            if not article_data["name"]:
-                self.task_queue.put({
-                    'type': 'error',
-                    'article_id': article_id,
-                    'text': "Please enter an article name."
-                })
-                return
-            
-            if article_data["start"] > article_data["end"]:
-                self.task_queue.put({
-                    'type': 'error',
-                    'article_id': article_id,
-                    'text': "Start page cannot be greater than end page."
-                })
-                return
-
-            # Create a new PDF with the selected pages
-            new_pdf = fitz.open()
-
-            # PDF pages are 0-indexed, but our UI uses 1-indexed
-            for page_num in range(article_data["start"] - 1, article_data["end"]):
-                new_pdf.insert_pdf(
-                    self.pdf_document,
-                    from_page=page_num,
-                    to_page=page_num
-                )
-
-            # Clean the filename to avoid invalid characters
-            safe_name = ''.join(c if c.isalnum() or c in [
-                                ' ', '-', '_'] else '_' for c in article_data["name"])
-
-            # Define output path
-            output_path = os.path.join(output_dir, f"{safe_name}.pdf")
-
-            # Update status
-            self.task_queue.put({
-                'type': 'status',
-                'text': f"Processing: {safe_name}.pdf..."
-            })
-
-            # If OCR is enabled, process the PDF with OCR
-            if self.ocr_enabled.get():
-                # First save the split PDF to a temporary file
-                with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as temp:
-                    temp_path = temp.name
-                    new_pdf.save(temp_path)
-                    new_pdf.close()
-
-                # Apply OCR and save to final destination
-                self._add_ocr_layer_thread(fitz.open(temp_path), output_path)
-
-                # Remove temporary file
-                os.unlink(temp_path)
-            else:
-                # Save directly without OCR
-                new_pdf.save(output_path)
-                new_pdf.close()
-
-            # Generate summary
-            self.task_queue.put({
-                'type': 'status',
-                'text': f"Creating summary for: {safe_name}.pdf..."
-            })
-            
-            # Call AI summarize for this specific article
-            self.ai_summarize.summarize(output_path)
-
-            # Signal completion
-            self.task_queue.put({
-                'type': 'status',
-                'text': f"Completed: {safe_name}.pdf with summary"
-            })
-            
-            self.task_queue.put({
-                'type': 'complete',
-                'article_id': article_id
-            })
+    def queue_article(self, article_id, article_data, output_dir, priority):
+        """Submit an article to the split -> OCR -> summarize pipeline"""
+        # The OCR option is read here on the Tk thread, not in the workers
+        job = make_job(article_id, article_data, self.pdf_path, output_dir,
+                       self.ocr_enabled.get())
+        self.source_jobs.setdefault(self.pdf_path, set()).add(article_id)
+        self.pipeline.submit(article_id, job, priority)
 
-        except Exception as e:
-            self.task_queue.put({
-                'type': 'error',
-                'article_id': article_id,
-                'text': f"Failed to create PDF for '{article_data['name']}': {e}"
-            })
-
-    def perform_ocr(self, page, dpi=300):
-        """Extract text from a page using OCR"""
-        # Render page to a high-resolution image
-        pix = page.get_pixmap(matrix=fitz.Matrix(dpi/72, dpi/72))
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-
-        # Use pytesseract to extract text
-        text = pytesseract.image_to_string(img)
-        return text
-
-    def _add_ocr_layer_thread(self, input_pdf, output_path):
-        """Process PDF and add OCR layer in background thread"""
-        self.task_queue.put({
-            'type': 'status',
-            'text': "Applying OCR to PDF (this may take a while)..."
-        })
-
-        # Create a new PDF with OCR text
-        doc = fitz.open()
-
-        total_pages = len(input_pdf)
-        for i, page in enumerate(input_pdf):
-            # Update status
-            self.task_queue.put({
-                'type': 'status',
-                'text': f"Applying OCR: page {i+1}/{total_pages}"
-            })
-
-            # Extract text using OCR
-            text = self.perform_ocr(page)
-
-            # Add page to new document
-            doc.insert_pdf(input_pdf, from_page=i, to_page=i)
-
-            # Add OCR text layer
-            if text:
-                doc[-1].insert_text(
-                    fitz.Point(0, 0),  # Insert at top-left
-                    text,
-                    fontsize=0.1,      # Very small font (invisible)
-                    color=(0, 0, 0, 0)  # Transparent color
-                )
-
-        # Save the OCR'd PDF
-        doc.save(output_path)
-        doc.close()
-
-        self.task_queue.put({
-            'type': 'status',
-            'text': f"OCR complete. PDF saved to {output_path}"
-        })
+    def perform_ocr(self, page, dpi=None):
+        """Extract text from a page using OCR, at a DPI suited to its text size unless given"""
+        return perform_ocr(page, dpi)
 
     def generate_remaining_pdfs(self):
         """Generate PDFs for articles that haven't been generated yet"""
@@ -626,31 +636,21 @@ class MagazineSplitter(tk.Tk):
             messagebox.showinfo("Info", "All articles have already been generated.")
             return
 
-        # Generate remaining articles using background threads
+        # Queue remaining articles in list order behind any interactive work
         for article_id, article_entry, article_data in remaining_articles:
+            if self.pipeline.is_active(article_id):
+                continue
+
             # Show processing status
             article_entry.status_label.config(text="Processing...", foreground="orange")
             article_entry.set_start_btn.config(state='disabled')
             article_entry.set_end_btn.config(state='disabled')
-            
-            # Start background thread
-            thread = threading.Thread(
-                target=self._generate_article_thread,
-                args=(article_id, article_data, output_dir),
-                daemon=True
-            )
-            thread.start()
+
+            self.queue_article(article_id, article_data, output_dir, BATCH_PRIORITY)
 
         self.set_status(f"Started background processing for {len(remaining_articles)} articles...")
 
 
 if __name__ == "__main__":
     app = MagazineSplitter()
-
-    # Handle window resize events to update PDF display
-    def on_resize(event):
-        if hasattr(app, 'pdf_document') and app.pdf_document:
-            app.update_page_display()
-
-    app.canvas.bind("<Configure>", on_resize)
     app.mainloop()
\ No newline at end of file
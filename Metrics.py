@@ -0,0 +1,111 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_FILE = 'metrics.jsonl'
+SUMMARY_FILE = 'metrics_summary.txt'
+
+# The Metrics and article the current code is working for, see article_context
+_current = contextvars.ContextVar('metrics_current', default=(None, None, None))
+
+
+class Metrics():
+    """Timing spans and token counts for one issue.
+
+    Every span is reported as a 'metric' event (see Progress) and appended as one JSON line to metrics.jsonl
+    in the issue's output folder. Totals per stage are kept for summary_table.
+    """
+
+    def __init__(self, output_dir=None, report=None):
+        self.path = os.path.join(output_dir, METRICS_FILE) if output_dir else None
+        self.output_dir = output_dir
+        self.report = report
+        self._lock = threading.Lock()
+        self._totals = {}  # stage -> [count, seconds, max seconds, prompt tokens, completion tokens, bytes written, bytes saved]
+
+    def record(self, stage, seconds, article_id=None, article=None, **fields):
+        event = {
+            'type': 'metric',
+            'time': time.time(),
+            'stage': stage,
+            'seconds': round(seconds, 6),
+            'article_id': article_id,
+            'article': article,
+        }
+        event.update(fields)
+
+        with self._lock:
+            totals = self._totals.setdefault(stage, [0, 0.0, 0.0, 0, 0, 0, 0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+            totals[3] += fields.get('prompt_tokens') or 0
+            totals[4] += fields.get('completion_tokens') or 0
+            totals[5] += fields.get('bytes') or 0
+            totals[6] += fields.get('bytes_saved') or 0
+            if self.path:
+                with open(self.path, 'a', encoding='utf-8') as file:
+                    file.write(json.dumps(event) + '\n')
+
+        if self.report:
+            self.report(event)
+
+    def summary_table(self):
+        """Per-stage totals as a fixed-width text table"""
+        with self._lock:
+            rows = sorted(self._totals.items(), key=lambda item: -item[1][1])
+        lines = [f"{'stage':<16}{'count':>7}{'total s':>10}{'mean s':>9}{'max s':>9}"
+                 f"{'prompt tok':>12}{'compl tok':>11}{'MB written':>12}{'MB saved':>10}"]
+        for stage, (count, seconds, longest, prompt_tokens, completion_tokens, bytes_written,
+                    bytes_saved) in rows:
+            lines.append(f"{stage:<16}{count:>7}{seconds:>10.2f}{seconds / count:>9.3f}{longest:>9.3f}"
+                         f"{prompt_tokens:>12}{completion_tokens:>11}"
+                         f"{bytes_written / 1e6:>12.1f}{bytes_saved / 1e6:>10.1f}")
+        return '\n'.join(lines)
+
+    def write_summary(self):
+        if not self.output_dir:
+            return
+        with open(os.path.join(self.output_dir, SUMMARY_FILE), 'w', encoding='utf-8') as file:
+            file.write(self.summary_table() + '\n')
+
+
+@contextmanager
+def article_context(metrics, article_id, article):
+    """Attribute spans recorded in this block to an article.
+
+    Work handed to a thread pool keeps the article only if it runs inside
+    contextvars.copy_context().
+    """
+    token = _current.set((metrics, article_id, article))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def current_article():
+    """(article id, article name) of the enclosing article_context, or (None, None)"""
+    _, article_id, article = _current.get()
+    return article_id, article
+
+
+def record(stage, seconds, **fields):
+    """Record a finished measurement for the current article, if anyone is listening"""
+    metrics, article_id, article = _current.get()
+    if metrics is not None:
+        metrics.record(stage, seconds, article_id, article, **fields)
+
+
+@contextmanager
+def span(stage, **fields):
+    """Time a block; the yielded dict can be filled with extra fields such as token counts"""
+    info = dict(fields)
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        record(stage, time.perf_counter() - start, **info)
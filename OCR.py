@@ -0,0 +1,406 @@
+import math
+import multiprocessing
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from DiskCache import DiskCache, file_hash
+import Metrics
+
+OCR_LANG = 'eng'
+
+# Recognized text per source page, shared by every run on this machine
+ocr_cache = DiskCache('ocr', max_bytes=256 * 1024 * 1024)
+
+# Page classes decided before OCR
+PAGE_TEXT = 'text'    # Already has a usable text layer
+PAGE_BLANK = 'blank'  # Nothing on it worth reading
+PAGE_IMAGE = 'image'  # Photo or artwork without text
+PAGE_SCAN = 'scan'    # Needs OCR
+
+NATIVE_TEXT_MIN_CHARS = 50  # Characters of extractable text that count as a text layer
+CLASSIFY_DPI = 50           # Resolution of the render used for the pixel statistics
+BLANK_MAX_STD = 6.0         # Grey level spread below which a page is empty
+IMAGE_MIN_MIDTONES = 0.5    # Share of mid-grey pixels typical of photos
+IMAGE_MAX_EDGES = 0.03      # Share of sharp horizontal transitions typical of print
+
+# OCR renders are grayscale, binarized and deskewed before tesseract sees them
+OCR_DPI = None              # None picks the DPI per page from the size of its text
+PROBE_DPI = 100             # Resolution of the render used to measure text size and skew
+MIN_OCR_DPI = 150           # Large display type
+MAX_OCR_DPI = 400           # Small print
+DEFAULT_OCR_DPI = 300       # Body text, and pages with too little text to measure
+BODY_MIN_PITCH = 10.0       # Line pitch in points of 8-12 pt body text at 1.2-1.5 leading,
+BODY_MAX_PITCH = 18.0       # which is read at DEFAULT_OCR_DPI
+MIN_LINE_PERIODICITY = 0.08  # Share of the row profile's power in its peak that counts as text lines
+MIN_INK_PIXELS = 200        # Ink needed to measure anything
+BINARIZE_K = 0.15           # How much darker than its surroundings ink has to be
+BINARIZE_BLOCK_INCHES = 1 / 6  # Size of the neighbourhood the local background is taken from
+MAX_SKEW_DEGREES = 5.0
+SKEW_STEP_DEGREES = 0.2
+SKEW_SAMPLE_PIXELS = 50000  # Ink pixels used to find the skew angle
+OCR_RENDER_VERSION = 3      # Part of the cache key; bump when the preprocessing changes
+
+# How pages are handed to tesseract
+ENGINE_PAGE = 'page'    # One pytesseract call, and so one tesseract process, per page
+ENGINE_BATCH = 'batch'  # One tesseract process per batch of pages, read from a list file
+OCR_ENGINE = os.environ.get('OCR_ENGINE', ENGINE_BATCH)
+OCR_BATCH_PAGES = 8     # Most pages per tesseract run
+
+# PyMuPDF, NumPy, Pillow and pytesseract are imported inside the functions that
+# use them, so importing this module at startup costs nothing
+
+# Documents opened by this worker process, keyed by (path, mtime)
+_documents = {}
+_MAX_OPEN_DOCUMENTS = 2
+
+
+def ocr_cache_key(pdf_path, page_index, dpi, lang):
+    return DiskCache.key(file_hash(pdf_path), page_index, dpi, lang, OCR_RENDER_VERSION)
+
+
+def _gray_pixels(page, dpi):
+    import fitz  # PyMuPDF
+    import numpy as np
+
+    pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72), colorspace=fitz.csGRAY, alpha=False)
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+
+
+def binarize(pixels, dpi):
+    """True where a pixel is ink, i.e. clearly darker than the local background.
+
+    The background is the mean of blocks of about BINARIZE_BLOCK_INCHES,
+    smoothed with their neighbours, so tinted boxes and uneven scans don't
+    turn into solid black the way one global threshold would.
+    """
+    import numpy as np
+
+    block = max(8, int(dpi * BINARIZE_BLOCK_INCHES))
+    height, width = pixels.shape
+    rows, cols = -(-height // block), -(-width // block)
+    padded = np.pad(pixels, ((0, rows * block - height), (0, cols * block - width)), mode='edge')
+    means = padded.reshape(rows, block, cols, block).mean(axis=(1, 3))
+
+    grid = np.pad(means, 1, mode='edge')
+    means = sum(grid[dy:dy + rows, dx:dx + cols] for dy in range(3) for dx in range(3)) / 9
+
+    threshold = np.repeat(np.repeat(means.astype(np.float32), block, axis=0), block, axis=1)
+    return pixels < threshold[:height, :width] * (1 - BINARIZE_K)
+
+
+def skew_angle(ink):
+    """Angle in degrees that makes the text lines level, from the sharpest row profile"""
+    import numpy as np
+
+    ys, xs = np.nonzero(ink)
+    if ys.size < MIN_INK_PIXELS:
+        return 0.0
+    step = ys.size // SKEW_SAMPLE_PIXELS + 1
+    ys, xs = ys[::step], xs[::step]
+
+    # Project the ink onto the rows for every candidate angle at once
+    angles = np.arange(-MAX_SKEW_DEGREES, MAX_SKEW_DEGREES + SKEW_STEP_DEGREES / 2, SKEW_STEP_DEGREES)
+    rows = np.rint(ys[None, :] - np.tan(np.radians(angles))[:, None] * xs[None, :]).astype(np.int64)
+    rows -= rows.min()
+    height = int(rows.max()) + 1
+    offsets = np.arange(len(angles))[:, None] * height
+    profiles = np.bincount((rows + offsets).ravel(),
+                           minlength=len(angles) * height).reshape(len(angles), height)
+
+    # Level lines give the most uneven profile: full text rows and empty gaps between them
+    return float(angles[np.argmax(profiles.var(axis=1))])
+
+
+def line_pitch_points(ink, dpi, angle=0.0):
+    """Distance between text lines in points, or None if the page has no regular lines.
+
+    The pitch is the strongest period of the row profile, taken along the
+    skew angle. Unlike the height of the letters it barely depends on the
+    typeface, and pages of photos or a lone headline have no clear period.
+    """
+    import numpy as np
+
+    ys, xs = np.nonzero(ink)
+    if ys.size < MIN_INK_PIXELS:
+        return None
+    rows = np.rint(ys - np.tan(np.radians(angle)) * xs).astype(np.int64)
+    profile = np.bincount(rows - rows.min()).astype(np.float64)
+    profile -= profile.mean()
+
+    size = 1 << (max(len(profile), 1024) - 1).bit_length()
+    power = np.abs(np.fft.rfft(profile, size)) ** 2
+    frequencies = np.fft.rfftfreq(size)
+
+    # Periods from 4 pt (tiny print) to 72 pt (a few lines of display type)
+    pixels_per_point = dpi / 72
+    band = np.flatnonzero((frequencies >= 1 / (72 * pixels_per_point))
+                          & (frequencies <= 1 / (4 * pixels_per_point)))
+    peak = band[np.argmax(power[band])]
+    if power[peak] < MIN_LINE_PERIODICITY * power[band].sum():
+        return None
+    return float(1 / frequencies[peak] / pixels_per_point)
+
+
+def choose_dpi(pitch_points):
+    """DEFAULT_OCR_DPI for body text, lower for display type, higher only for small print"""
+    if not pitch_points:
+        return DEFAULT_OCR_DPI
+    dpi = DEFAULT_OCR_DPI
+    if pitch_points < BODY_MIN_PITCH:
+        dpi *= BODY_MIN_PITCH / pitch_points
+    elif pitch_points > BODY_MAX_PITCH:
+        dpi *= BODY_MAX_PITCH / pitch_points
+    dpi = round(dpi / 25) * 25
+    return int(min(MAX_OCR_DPI, max(MIN_OCR_DPI, dpi)))
+
+
+def prepare_ocr_image(page, dpi=OCR_DPI):
+    """Render a page for tesseract: grayscale, binarized and deskewed.
+
+    Returns (PIL image, dpi). With dpi None the resolution is picked from
+    the line pitch measured on a PROBE_DPI render.
+    """
+    from PIL import Image
+
+    probe_ink = binarize(_gray_pixels(page, PROBE_DPI), PROBE_DPI)
+    angle = skew_angle(probe_ink)
+    if dpi is None:
+        dpi = choose_dpi(line_pitch_points(probe_ink, PROBE_DPI, angle))
+
+    ink = binarize(_gray_pixels(page, dpi), dpi)
+    img = Image.fromarray((~ink).view('uint8') * 255)
+    if abs(angle) >= SKEW_STEP_DEGREES:
+        img = img.rotate(angle, resample=Image.NEAREST, fillcolor=255)
+    return img, dpi
+
+
+def _recognize(page, dpi, lang):
+    """OCR one page, returns (text, dpi used)"""
+    import pytesseract
+
+    img, dpi = prepare_ocr_image(page, dpi)
+    return pytesseract.image_to_string(img, lang=lang, config=f'--dpi {dpi}'), dpi
+
+
+def perform_ocr(page, dpi=OCR_DPI, lang=OCR_LANG):
+    """Extract text from a page using OCR, reusing cached text for pages of saved files"""
+    pdf_path = page.parent.name
+    if not pdf_path or not os.path.isfile(pdf_path):
+        return _recognize(page, dpi, lang)[0]
+
+    key = ocr_cache_key(pdf_path, page.number, dpi, lang)
+    text = ocr_cache.get_text(key)
+    if text is None:
+        text = _recognize(page, dpi, lang)[0]
+        ocr_cache.put_text(key, text)
+    return text
+
+
+def classify_page(page):
+    """Decide whether a page needs OCR using its text layer and a low-res render"""
+    import fitz  # PyMuPDF
+    import numpy as np
+
+    if len(page.get_text("text").strip()) >= NATIVE_TEXT_MIN_CHARS:
+        return PAGE_TEXT
+
+    zoom = CLASSIFY_DPI / 72
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+    pixels = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+
+    if pixels.std() < BLANK_MAX_STD:
+        return PAGE_BLANK
+
+    # Printed text shows up as many hard dark/light transitions, photos as smooth mid-tones
+    midtones = np.count_nonzero((pixels > 64) & (pixels < 192)) / pixels.size
+    edges = np.abs(np.diff(pixels.astype(np.int16), axis=1)) > 64
+    edge_share = np.count_nonzero(edges) / edges.size
+    if midtones > IMAGE_MIN_MIDTONES and edge_share < IMAGE_MAX_EDGES:
+        return PAGE_IMAGE
+
+    return PAGE_SCAN
+
+
+def _open_document(pdf_path):
+    """Return a handle on pdf_path that is reused across calls in this process"""
+    key = (pdf_path, os.path.getmtime(pdf_path))
+    document = _documents.get(key)
+    if document is None:
+        # Keep only a couple of issues open per worker
+        while len(_documents) >= _MAX_OPEN_DOCUMENTS:
+            _documents.pop(next(iter(_documents))).close()
+        import fitz  # PyMuPDF
+        document = fitz.open(pdf_path)
+        _documents[key] = document
+    return document
+
+
+def _tesseract_batch(image_paths, lang):
+    """Recognize several images with one tesseract run and return the text of each"""
+    import pytesseract
+
+    folder = os.path.dirname(image_paths[0])
+    list_path = os.path.join(folder, 'pages.txt')
+    with open(list_path, 'w', encoding='utf-8') as file:
+        file.write('\n'.join(image_paths) + '\n')
+
+    completed = subprocess.run(
+        [pytesseract.pytesseract.tesseract_cmd, list_path, 'stdout', '-l', lang],
+        capture_output=True, check=True)
+
+    # Tesseract ends every page with a form feed
+    texts = completed.stdout.decode('utf-8', errors='replace').split('\f')
+    if len(texts) == len(image_paths) + 1 and not texts[-1].strip():
+        texts.pop()
+    if len(texts) != len(image_paths):
+        raise RuntimeError(f"Expected {len(image_paths)} pages from tesseract, got {len(texts)}")
+    return texts
+
+
+def ocr_batch(pdf_path, page_indices, dpi=OCR_DPI, lang=OCR_LANG, engine=OCR_ENGINE):
+    """Worker entry point: OCR pages of the PDF at pdf_path.
+
+    Returns ([(text, dpi used, seconds preparing the page), ...], seconds in
+    tesseract). The batch engine writes the prepared pages to PNG files
+    (with their DPI) and reads them all in one tesseract run, so process
+    start and model loading are paid once per batch. If that run fails, the
+    pages are read one by one instead.
+    """
+    import pytesseract
+
+    try:
+        return _ocr_batch(pdf_path, page_indices, dpi, lang, engine)
+    except pytesseract.TesseractNotFoundError as e:
+        # This error can't be unpickled in the parent, where it would break the whole pool
+        raise RuntimeError(str(e)) from None
+
+
+def _ocr_batch(pdf_path, page_indices, dpi, lang, engine):
+    import pytesseract
+
+    document = _open_document(pdf_path)
+    if engine == ENGINE_PAGE:
+        results = []
+        tesseract_seconds = 0.0
+        for page_index in page_indices:
+            start = time.perf_counter()
+            img, page_dpi = prepare_ocr_image(document[page_index], dpi)
+            prepared = time.perf_counter()
+            text = pytesseract.image_to_string(img, lang=lang, config=f'--dpi {page_dpi}')
+            tesseract_seconds += time.perf_counter() - prepared
+            results.append((text, page_dpi, prepared - start))
+        return results, tesseract_seconds
+
+    with tempfile.TemporaryDirectory(prefix='magazine-ocr-') as folder:
+        image_paths = []
+        prepared = []  # (dpi, seconds) per page
+        for position, page_index in enumerate(page_indices):
+            # Written straight away so only one page image is held in memory
+            start = time.perf_counter()
+            img, page_dpi = prepare_ocr_image(document[page_index], dpi)
+            image_paths.append(os.path.join(folder, f'page{position:04d}.png'))
+            img.save(image_paths[-1], dpi=(page_dpi, page_dpi))
+            prepared.append((page_dpi, time.perf_counter() - start))
+
+        start = time.perf_counter()
+        try:
+            texts = _tesseract_batch(image_paths, lang)
+        except (OSError, subprocess.CalledProcessError, RuntimeError):
+            texts = [pytesseract.image_to_string(path, lang=lang) for path in image_paths]
+        tesseract_seconds = time.perf_counter() - start
+
+    results = [(text, page_dpi, seconds) for text, (page_dpi, seconds) in zip(texts, prepared)]
+    return results, tesseract_seconds
+
+
+class OcrPool():
+    """Spread page OCR over a pool of worker processes.
+
+    engine is ENGINE_BATCH (one tesseract run per batch of pages) or
+    ENGINE_PAGE (one per page); ocr_pages works the same with either.
+    """
+
+    def __init__(self, workers=None, engine=OCR_ENGINE):
+        self.workers = workers or os.cpu_count() or 1
+        self.engine = engine
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Start the worker processes on first use; spawn, because forking a
+        # process that runs Tk and worker threads is unsafe
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _discard_executor(self, executor):
+        """Drop a pool whose worker died, so the next call starts a fresh one"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def ocr_pages(self, pdf_path, page_indices, dpi=OCR_DPI, lang=OCR_LANG, progress=None):
+        """OCR the given pages of pdf_path and return their text in the same order.
+
+        Pages found in the OCR cache are not sent to the workers. progress, if
+        given, is called as progress(done, total) each time a page finishes.
+        """
+        texts = [None] * len(page_indices)
+        keys = {}
+        for position, page_index in enumerate(page_indices):
+            keys[position] = ocr_cache_key(pdf_path, page_index, dpi, lang)
+            with Metrics.span('ocr_cache_lookup', page=page_index) as info:
+                texts[position] = ocr_cache.get_text(keys[position])
+                info['hit'] = texts[position] is not None
+
+        done = len(page_indices) - texts.count(None)
+        if progress and done:
+            progress(done, len(texts))
+
+        missing = [position for position, text in enumerate(texts) if text is None]
+        if not missing:
+            return texts
+
+        # Batches small enough that every worker gets one
+        size = 1
+        if self.engine == ENGINE_BATCH:
+            size = max(1, min(OCR_BATCH_PAGES, math.ceil(len(missing) / self.workers)))
+        batches = [missing[i:i + size] for i in range(0, len(missing), size)]
+
+        executor = self._get_executor()
+        try:
+            futures = {
+                executor.submit(ocr_batch, pdf_path, [page_indices[position] for position in batch],
+                                dpi, lang, self.engine): batch
+                for batch in batches
+            }
+            finished = ((futures[future], future.result()) for future in as_completed(futures))
+            for batch, (results, tesseract_seconds) in finished:
+                # Rendering is timed per page, tesseract per run, which covers the whole batch
+                Metrics.record('ocr_tesseract', tesseract_seconds, pages=len(batch), engine=self.engine)
+                for position, (text, page_dpi, prepare_seconds) in zip(batch, results):
+                    texts[position] = text
+                    Metrics.record('ocr_prepare', prepare_seconds,
+                                   page=page_indices[position], dpi=page_dpi)
+                    ocr_cache.put_text(keys[position], text)
+                done += len(batch)
+                if progress:
+                    progress(done, len(texts))
+        except BrokenProcessPool as e:
+            # A worker died, e.g. killed for memory; the next article gets a fresh pool
+            self._discard_executor(executor)
+            raise RuntimeError(f"An OCR worker process stopped unexpectedly: {e}") from e
+        return texts
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,151 @@
+import threading
+from collections import OrderedDict
+
+
+def render_pixmap(document, page_index, width, height):
+    """Render a page to an RGB pixmap that fits inside width x height"""
+    import fitz  # PyMuPDF
+
+    page = document[page_index]
+
+    # Pick the zoom so the pixmap already has the target size
+    if width > 1 and height > 1:  # Ensure canvas has been drawn
+        zoom = min(width / page.rect.width, height / page.rect.height)
+    else:
+        zoom = 1.5
+
+    return page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+
+
+def render_page(document, page_index, width, height):
+    """Render a page straight to a PIL image that fits inside width x height"""
+    from PIL import Image
+
+    pix = render_pixmap(document, page_index, width, height)
+
+    # Wrap the raw samples instead of encoding and decoding an image file
+    return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+
+class PageCache():
+    """Thread-safe LRU cache of rendered page images, capped by memory use"""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def image_size(img):
+        return img.width * img.height * len(img.getbands())
+
+    def get(self, page_index, width, height):
+        key = (page_index, width, height)
+        with self._lock:
+            img = self._images.get(key)
+            if img is not None:
+                self._images.move_to_end(key)
+            return img
+
+    def contains(self, page_index, width, height):
+        with self._lock:
+            return (page_index, width, height) in self._images
+
+    def put(self, page_index, width, height, img):
+        key = (page_index, width, height)
+        size = self.image_size(img)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._images:
+                self.current_bytes -= self.image_size(self._images.pop(key))
+            self._images[key] = img
+            self.current_bytes += size
+
+            # Evict least recently used pages until we are under the cap
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self.current_bytes -= self.image_size(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self.current_bytes = 0
+
+
+class BackgroundRenderer():
+    """Daemon thread that works through pending items, in order, one at a time.
+
+    Each request replaces whatever is still pending, so pages the user has
+    already moved away from are dropped instead of rendered late. Subclasses
+    do the work for one item in process; an item that raises is skipped.
+    """
+
+    def __init__(self):
+        self._pending = []
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _replace_pending(self, items):
+        with self._condition:
+            self._pending = list(items)
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._pending = []
+            self._condition.notify()
+
+    def process(self, item):
+        raise NotImplementedError
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                item = self._pending.pop(0)
+
+            try:
+                self.process(item)
+            except Exception:
+                continue
+
+
+class PagePrefetcher(BackgroundRenderer):
+    """Background renderer that fills a PageCache with the neighbours of the current page.
+
+    render is called as render(page_index, width, height) and returns a PIL
+    image, e.g. DocumentService.render.
+    """
+
+    def __init__(self, render, cache, radius=3):
+        self.render = render
+        self.cache = cache
+        self.radius = radius
+        super().__init__()
+
+    def request(self, page_index, page_count, width, height):
+        """Replace pending work with the pages around page_index, nearest first"""
+        if width <= 1 or height <= 1:
+            return
+
+        pending = []
+        for distance in range(1, self.radius + 1):
+            for neighbour in (page_index + distance, page_index - distance):
+                if 0 <= neighbour < page_count:
+                    pending.append((neighbour, width, height))
+
+        self._replace_pending(pending)
+
+    def process(self, item):
+        page_index, width, height = item
+        if not self.cache.contains(page_index, width, height):
+            self.cache.put(page_index, width, height, self.render(page_index, width, height))
@@ -0,0 +1,212 @@
+"""Per-page layout features of an issue and article boundaries proposed from them.
+
+The features are computed once per issue and cached next to the PDF
+(issue.pdf -> issue.features.npz), so reopening an issue only runs the
+scoring, which is a handful of NumPy operations over all pages at once.
+"""
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from DiskCache import file_hash
+
+# Horizontal bands of the page the text density histogram counts characters in
+DENSITY_BINS = 8
+
+# Text this much larger than the issue's body text counts as a headline
+HEADLINE_RATIO = 1.6
+
+# Body text size assumed for issues without any text layer
+DEFAULT_BODY_SIZE = 10.0
+
+# A short line like "By Jane Smith" near the top of an article
+BYLINE = re.compile(r'^(?:by|written by|text by|words by)\s+[A-Z]', re.IGNORECASE)
+BYLINE_MAX_CHARS = 60
+
+# Pages indexed per request to the document service, so the viewer is never kept waiting long
+INDEX_CHUNK_PAGES = 32
+
+# Score weights; a page scoring at least START_SCORE starts a new article
+HEADLINE_WEIGHT = 2.0
+BYLINE_WEIGHT = 1.5
+DENSITY_CHANGE_WEIGHT = 1.0
+IMAGE_CHANGE_WEIGHT = 0.5
+START_SCORE = 2.0
+
+# Longest headline used as a proposed article name
+MAX_NAME_CHARS = 80
+
+FEATURE_NAMES = ('max_size', 'body_size', 'chars', 'byline', 'density', 'image_coverage', 'headline')
+
+
+def page_features(page):
+    """Features of one page as a tuple in FEATURE_NAMES order"""
+    import fitz  # PyMuPDF
+
+    width, height = page.rect.width or 1, page.rect.height or 1
+    density = [0] * DENSITY_BINS
+    size_chars = {}  # Rounded font size -> characters set in it
+    max_size = 0.0
+    headline = ''
+    byline = False
+
+    # Leave the image data out of the dict, we only need the text
+    text = page.get_text('dict', flags=fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES)
+    for block in text['blocks']:
+        for line in block.get('lines', ()):
+            line_text = ''.join(span['text'] for span in line['spans']).strip()
+            if not line_text:
+                continue
+
+            band = int((line['bbox'][1] + line['bbox'][3]) / 2 / height * DENSITY_BINS)
+            density[min(max(band, 0), DENSITY_BINS - 1)] += len(line_text)
+
+            if len(line_text) <= BYLINE_MAX_CHARS and BYLINE.match(line_text):
+                byline = True
+
+            for span in line['spans']:
+                span_chars = len(span['text'].strip())
+                if not span_chars:
+                    continue
+                size = round(span['size'], 1)
+                size_chars[size] = size_chars.get(size, 0) + span_chars
+                if size > max_size:
+                    max_size = size
+                    headline = line_text
+                elif size == max_size and line_text not in headline:
+                    headline = f"{headline} {line_text}"
+
+    chars = sum(density)
+    # The size most of the page's characters are set in
+    body_size = max(size_chars, key=size_chars.get) if size_chars else 0.0
+
+    image_area = 0.0
+    for image in page.get_image_info():
+        rect = fitz.Rect(image['bbox']) & page.rect
+        if not rect.is_empty:
+            image_area += rect.width * rect.height
+    image_coverage = min(1.0, image_area / (width * height))
+
+    return (max_size, body_size, chars, byline, density, image_coverage,
+            headline[:MAX_NAME_CHARS].strip())
+
+
+def compute_features(document, start=0, stop=None):
+    """Features of pages start..stop-1 of an open fitz document, as NumPy arrays"""
+    import numpy as np
+
+    stop = len(document) if stop is None else min(stop, len(document))
+    rows = [page_features(document[index]) for index in range(start, stop)]
+    columns = list(zip(*rows)) if rows else [()] * len(FEATURE_NAMES)
+    return {
+        'max_size': np.array(columns[0], dtype=np.float32),
+        'body_size': np.array(columns[1], dtype=np.float32),
+        'chars': np.array(columns[2], dtype=np.int32),
+        'byline': np.array(columns[3], dtype=bool),
+        'density': np.array(columns[4], dtype=np.float32).reshape(-1, DENSITY_BINS),
+        'image_coverage': np.array(columns[5], dtype=np.float32),
+        'headline': np.array(columns[6], dtype=str),
+    }
+
+
+def merge_features(parts):
+    import numpy as np
+    return {name: np.concatenate([part[name] for part in parts]) for name in FEATURE_NAMES}
+
+
+def features_path(pdf_path):
+    return os.path.splitext(pdf_path)[0] + '.features.npz'
+
+
+def load_features(pdf_path):
+    """Cached features of an issue, or None if missing or made for a different file"""
+    import numpy as np
+
+    try:
+        with np.load(features_path(pdf_path), allow_pickle=False) as data:
+            if str(data['pdf_hash']) != file_hash(pdf_path):
+                return None
+            return {name: data[name] for name in FEATURE_NAMES}
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def save_features(pdf_path, features):
+    """Write the features next to the PDF; a read-only folder just means no cache"""
+    import numpy as np
+
+    path = features_path(pdf_path)
+    try:
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            np.savez_compressed(file, pdf_hash=np.array(file_hash(pdf_path)), **features)
+        os.replace(temp_path, path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+
+def index_document(pdf_path, document):
+    """Return the features of every page, from the cache or computed through document.
+
+    document is a DocumentService or LocalDocument for pdf_path. The chunks
+    go to as many of its workers at once as it has. The first index of an
+    issue is CPU bound, a few milliseconds per page and worker, so a
+    300-page issue takes about a second on one core and half that on two.
+    """
+    features = load_features(pdf_path)
+    if features is None:
+        page_count = len(document)
+        starts = range(0, page_count, INDEX_CHUNK_PAGES)
+        with ThreadPoolExecutor(max_workers=getattr(document, 'concurrency', 1)) as executor:
+            parts = executor.map(
+                lambda start: document.features(start, min(start + INDEX_CHUNK_PAGES, page_count)), starts)
+            features = merge_features(list(parts))
+        save_features(pdf_path, features)
+    return features
+
+
+def start_scores(features):
+    """How strongly each page looks like the first page of an article"""
+    import numpy as np
+
+    body_sizes = features['body_size'][features['chars'] > 0]
+    body_size = float(np.median(body_sizes)) if body_sizes.size else DEFAULT_BODY_SIZE
+
+    headline = features['max_size'] >= body_size * HEADLINE_RATIO
+
+    # Half the L1 distance between the text distributions of neighbouring pages, 0..1
+    density = features['density']
+    totals = density.sum(axis=1, keepdims=True)
+    shares = np.divide(density, totals, out=np.zeros_like(density), where=totals > 0)
+    density_change = np.concatenate([[0.0], np.abs(np.diff(shares, axis=0)).sum(axis=1) / 2])
+
+    image_change = np.concatenate([[0.0], np.abs(np.diff(features['image_coverage']))])
+
+    return (HEADLINE_WEIGHT * headline
+            + BYLINE_WEIGHT * features['byline']
+            + DENSITY_CHANGE_WEIGHT * density_change
+            + IMAGE_CHANGE_WEIGHT * image_change)
+
+
+def propose_articles(features):
+    """Proposed articles as {name, start, end} with 1-indexed pages, covering the whole issue"""
+    import numpy as np
+
+    page_count = len(features['chars'])
+    if not page_count:
+        return []
+
+    starts = np.flatnonzero(start_scores(features) >= START_SCORE)
+    if not starts.size or starts[0] != 0:
+        starts = np.concatenate([[0], starts])
+    ends = np.concatenate([starts[1:] - 1, [page_count - 1]])
+
+    articles = []
+    for number, (start, end) in enumerate(zip(starts.tolist(), ends.tolist()), 1):
+        name = str(features['headline'][start]) or f"Article {number}"
+        articles.append({"name": name, "start": start + 1, "end": end + 1})
+    return articles
@@ -0,0 +1,102 @@
+import threading
+import queue
+import itertools
+
+
+class Stage():
+    """One step of the pipeline with its own bounded pool of worker threads"""
+
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.queue = queue.PriorityQueue()
+
+
+class ArticlePipeline():
+    """Run jobs through a sequence of stages, each with its own concurrency.
+
+    Every stage function receives the job produced by the previous stage and
+    returns the job for the next one (or None to stop processing it). Jobs
+    with a lower priority number are picked up first, and jobs that are still
+    waiting in a stage queue can be cancelled.
+    """
+
+    def __init__(self, stages, on_error=None):
+        self.stages = stages
+        self.on_error = on_error
+        self._counter = itertools.count()  # Keeps FIFO order within a priority
+        self._lock = threading.Lock()
+        self._cancelled = set()
+        self._active = {}  # job_id -> number of submissions still in the pipeline
+        self._threads = []
+
+        for index, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._worker, args=(index,), daemon=True,
+                    name=f"{stage.name}-worker")
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, job_id, job, priority=0, stage=0):
+        """Queue a job at the first stage, or at a later one when resuming earlier work"""
+        with self._lock:
+            self._cancelled.discard(job_id)
+            self._active[job_id] = self._active.get(job_id, 0) + 1
+        self._enqueue(stage, priority, job_id, job)
+
+    def cancel(self, job_id):
+        """Drop a job the next time it comes off a stage queue.
+
+        Returns True if the job was still in the pipeline. Work already running
+        in a stage finishes, but the job does not move on to the next stage.
+        """
+        with self._lock:
+            if job_id not in self._active:
+                return False
+            self._cancelled.add(job_id)
+            return True
+
+    def is_active(self, job_id):
+        with self._lock:
+            return job_id in self._active
+
+    def pending_count(self):
+        return sum(stage.queue.qsize() for stage in self.stages)
+
+    def _enqueue(self, index, priority, job_id, job):
+        self.stages[index].queue.put((priority, next(self._counter), job_id, job))
+
+    def _finish(self, job_id):
+        with self._lock:
+            remaining = self._active.get(job_id, 0) - 1
+            if remaining > 0:
+                self._active[job_id] = remaining
+            else:
+                self._active.pop(job_id, None)
+                self._cancelled.discard(job_id)
+
+    def _worker(self, index):
+        stage = self.stages[index]
+        while True:
+            priority, _, job_id, job = stage.queue.get()
+
+            with self._lock:
+                cancelled = job_id in self._cancelled
+            if cancelled:
+                self._finish(job_id)
+                continue
+
+            try:
+                result = stage.func(job)
+            except Exception as e:
+                self._finish(job_id)
+                if self.on_error:
+                    self.on_error(job_id, job, e)
+                continue
+
+            if result is None or index + 1 == len(self.stages):
+                self._finish(job_id)
+            else:
+                self._enqueue(index + 1, priority, job_id, result)
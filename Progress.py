@@ -0,0 +1,71 @@
+import itertools
+import threading
+import Metrics
+
+# Event types; every event is a dict with a 'type' key and, where known, an 'article_id'
+STATUS = 'status'        # text: a line for the status bar or log
+PROGRESS = 'progress'    # text, stage, done, total: how far an article's stage has got
+COMPLETE = 'complete'    # The article is finished
+ERROR = 'error'          # text: why the article failed
+METRIC = 'metric'        # A timing span, see Metrics.Metrics.record
+PROPOSALS = 'proposals'  # pdf_path, articles, seconds: article boundaries suggested for an issue
+
+# Only the latest of these per article matters to someone watching
+COALESCED_TYPES = (STATUS, PROGRESS, METRIC)
+
+
+def status(text, article_id=None):
+    return {'type': STATUS, 'article_id': article_id, 'text': text}
+
+
+def progress(stage, done, total, text=None, article_id=None):
+    return {'type': PROGRESS, 'article_id': article_id, 'stage': stage,
+            'done': done, 'total': total, 'text': text or f"{stage}: {done}/{total}"}
+
+
+class ProgressBus():
+    """Hands events from worker threads to one consumer without ever blocking the worker.
+
+    publish only takes a short lock. Status, progress and metric events are
+    coalesced to the latest one per article until the next drain, so a
+    consumer that looks a few times per second sees the current state
+    instead of a backlog. Complete and error events are always delivered,
+    in the order they were published.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._sequence = itertools.count()
+        self._ordered = []
+        self._latest = {}  # (type, article id) -> newest coalesced event
+
+    def publish(self, event):
+        event = dict(event)
+        if event.get('article_id') is None:
+            # Status lines from deep inside a stage still belong to its article
+            event['article_id'] = Metrics.current_article()[0]
+
+        with self._condition:
+            event['sequence'] = next(self._sequence)
+            if event['type'] in COALESCED_TYPES:
+                self._latest[(event['type'], event['article_id'])] = event
+            else:
+                self._ordered.append(event)
+            self._condition.notify()
+
+    def publish_status(self, text):
+        self.publish(status(text))
+
+    def drain(self, timeout=None):
+        """Return everything published since the last drain, oldest first.
+
+        With a timeout, wait up to that many seconds for something to arrive.
+        """
+        with self._condition:
+            if timeout and not (self._ordered or self._latest):
+                self._condition.wait(timeout)
+            events = self._ordered + list(self._latest.values())
+            self._ordered = []
+            self._latest = {}
+        events.sort(key=lambda event: event['sequence'])
+        return events
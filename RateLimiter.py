@@ -0,0 +1,64 @@
+import threading
+import time
+from collections import deque
+
+WINDOW_SECONDS = 60
+
+
+class RateLimiter():
+    """Sliding-window limit on requests and tokens per minute.
+
+    One instance is meant to be shared by every thread that talks to the API,
+    so all articles in flight draw from the same budget. A limit of 0 or None
+    disables that check.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._events = deque()  # (timestamp, tokens) of recent requests
+        self._tokens_in_window = 0
+        self._blocked_until = 0.0  # Set after the server asks us to slow down
+        self._condition = threading.Condition()
+
+    def _expire(self, now):
+        while self._events and now - self._events[0][0] >= WINDOW_SECONDS:
+            _, tokens = self._events.popleft()
+            self._tokens_in_window -= tokens
+
+    def _wait_time(self, now, tokens):
+        """Seconds until a request of this size fits, or 0 if it fits now"""
+        wait = self._blocked_until - now
+        if self.requests_per_minute and len(self._events) >= self.requests_per_minute:
+            oldest = self._events[len(self._events) - self.requests_per_minute][0]
+            wait = max(wait, oldest + WINDOW_SECONDS - now)
+
+        if self.tokens_per_minute and self._events:
+            # A single request bigger than the budget is allowed through on an empty window
+            excess = self._tokens_in_window + tokens - self.tokens_per_minute
+            released = 0
+            for timestamp, event_tokens in self._events:
+                if excess <= released:
+                    break
+                released += event_tokens
+                wait = max(wait, timestamp + WINDOW_SECONDS - now)
+        return wait
+
+    def acquire(self, tokens=0):
+        """Block until a request using this many tokens is allowed, then record it"""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                wait = self._wait_time(now, tokens)
+                if wait <= 0:
+                    self._events.append((now, tokens))
+                    self._tokens_in_window += tokens
+                    return
+                self._condition.wait(wait)
+
+    def penalize(self, seconds):
+        """Hold back every caller for a while, e.g. after the server returned 429"""
+        with self._condition:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._condition.notify_all()
@@ -0,0 +1,140 @@
+"""Full-text search over every article generated so far.
+
+Usage:
+    python SearchIndex.py "harvest festival"
+    python SearchIndex.py 'name:choir AND summary:christmas' --limit 50
+
+Each article is added to a SQLite FTS5 index as soon as its summary is
+written, with its text, summary, tags, page range and source issue, so a
+search never opens the PDFs. The query uses the FTS5 syntax: words, "exact
+phrases", AND/OR/NOT and column filters such as name: or issue:.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+from functools import lru_cache
+from DiskCache import CACHE_ROOT
+
+# Shared by the window, BatchSplit and HotFolder, override with MAGAZINE_SPLITTER_INDEX
+INDEX_PATH = os.environ.get('MAGAZINE_SPLITTER_INDEX', os.path.join(CACHE_ROOT, 'articles.sqlite'))
+
+# Seconds to wait for another process that is writing to the index
+BUSY_TIMEOUT = 10
+
+# Words of context around the matches shown in search results
+SNIPPET_TOKENS = 12
+
+
+class ArticleIndex():
+    """SQLite FTS5 index of generated articles, one row per article PDF"""
+
+    def __init__(self, path=INDEX_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        with self._connection:
+            self._connection.executescript('''
+                CREATE TABLE IF NOT EXISTS articles (
+                    id INTEGER PRIMARY KEY,
+                    output_path TEXT NOT NULL UNIQUE,
+                    source_path TEXT NOT NULL,
+                    issue TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    start_page INTEGER NOT NULL,
+                    end_page INTEGER NOT NULL,
+                    indexed_at REAL NOT NULL
+                );
+                CREATE VIRTUAL TABLE IF NOT EXISTS article_text USING fts5(
+                    name, summary, text, tags, issue,
+                    tokenize = 'porter unicode61 remove_diacritics 2'
+                );
+            ''')
+
+    def add_article(self, output_path, source_path, name, start_page, end_page,
+                    text, summary, tags=()):
+        """Add an article, or replace it if this PDF was indexed before"""
+        output_path = os.path.abspath(output_path)
+        issue = os.path.splitext(os.path.basename(source_path))[0]
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                'SELECT id FROM articles WHERE output_path = ?', (output_path,)).fetchone()
+            if row:
+                article_id = row[0]
+                self._connection.execute(
+                    'UPDATE articles SET source_path = ?, issue = ?, name = ?, start_page = ?, '
+                    'end_page = ?, indexed_at = ? WHERE id = ?',
+                    (source_path, issue, name, start_page, end_page, time.time(), article_id))
+                self._connection.execute('DELETE FROM article_text WHERE rowid = ?', (article_id,))
+            else:
+                article_id = self._connection.execute(
+                    'INSERT INTO articles (output_path, source_path, issue, name, start_page, '
+                    'end_page, indexed_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (output_path, source_path, issue, name, start_page, end_page,
+                     time.time())).lastrowid
+            self._connection.execute(
+                'INSERT INTO article_text (rowid, name, summary, text, tags, issue) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (article_id, name, summary or '', text, ' '.join(tags), issue))
+
+    def search(self, query, limit=20):
+        """Best matches first, as dicts with the article's details and a text snippet"""
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT a.name, a.issue, a.start_page, a.end_page, a.output_path, '
+                f"snippet(article_text, -1, '[', ']', '...', {SNIPPET_TOKENS}) "
+                'FROM article_text JOIN articles a ON a.id = article_text.rowid '
+                'WHERE article_text MATCH ? ORDER BY bm25(article_text, 10.0, 5.0, 1.0, 5.0, 2.0) '
+                'LIMIT ?', (query, limit)).fetchall()
+        return [dict(zip(('name', 'issue', 'start', 'end', 'output_path', 'snippet'), row))
+                for row in rows]
+
+    def article_count(self):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM articles').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+@lru_cache(maxsize=None)
+def get_article_index():
+    """Shared by every ArticleProcessor in the process"""
+    return ArticleIndex()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search the text and summaries of generated articles.")
+    parser.add_argument('query', help="FTS5 query, e.g. words, \"a phrase\" or name:choir")
+    parser.add_argument('--limit', type=int, default=20, help="Most results to show")
+    parser.add_argument('--index', default=INDEX_PATH, help=f"Index database (default: {INDEX_PATH})")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.index):
+        print(f"No index at {args.index}; generate some articles first.", file=sys.stderr)
+        return 2
+
+    index = ArticleIndex(args.index)
+    start = time.perf_counter()
+    try:
+        results = index.search(args.query, args.limit)
+    except sqlite3.OperationalError as e:
+        print(f"Invalid query: {e}", file=sys.stderr)
+        return 2
+    seconds = time.perf_counter() - start
+
+    for entry in results:
+        print(f"{entry['issue']} p.{entry['start']}-{entry['end']}  {entry['name']}")
+        print(f"    {entry['snippet']}")
+        print(f"    {entry['output_path']}")
+    print(f"{len(results)} results from {index.article_count()} articles in {seconds * 1000:.1f} ms")
+    index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,172 @@
-from openai import OpenAI
-import PyPDF2
-import tiktoken
 import os
+import math
+import random
+import re
 import subprocess
 import shutil
-from dotenv import load_dotenv
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import time
+from RateLimiter import RateLimiter
+from DiskCache import DiskCache
+import Metrics
 
 MODEL = 'gpt-4o-mini'
 SUMMARY_SIZE = 200
 
+# Chunk summaries requested at the same time for one article
+CHUNK_WORKERS = 4
+
+# Context window of the models we use, in tokens
+MODEL_CONTEXT_TOKENS = {
+    'gpt-4o-mini': 128000,
+    'gpt-4o': 128000,
+    'gpt-4-turbo': 128000,
+    'gpt-3.5-turbo': 16385,
+}
+DEFAULT_CONTEXT_TOKENS = 8192
+
+# Most article text sent in one request, even if the context window allows more
+MAX_INPUT_TOKENS = 16000
+
+# Tokens reserved for each reply
+RESPONSE_TOKENS = 500
+
+# Chat formatting tokens added around every message
+MESSAGE_OVERHEAD_TOKENS = 8
+
+SYSTEM_PROMPT = "You are an assistant that summarizes text."
+
+# Tags the final summary is asked to end with
+SUMMARY_TAGS = 5
+
+# "Tags:", "**Tags:**" or "Suggested tags -" in front of the tags at the end of a summary
+TAGS_HEADING = re.compile(r'^[\W_]*(?:suggested\s+)?tags?[*_\s]*(?:[:\-][*_\s]*(.*)|$)', re.IGNORECASE)
+
+# Sentence ends and paragraph breaks where chunks may be cut
+SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+|\n\s*\n')
+
+# Retries for rate limited (429) and server side (5xx) failures
+MAX_RETRIES = 6
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+
+# Chunk and final summaries from earlier runs
+summary_cache = DiskCache('summaries', max_bytes=64 * 1024 * 1024)
+
+
+@lru_cache(maxsize=None)
+def load_environment():
+    """Read the .env file once, the first time a setting is needed"""
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+@lru_cache(maxsize=None)
+def get_rate_limiter():
+    """Shared by every AISummarize in the process so all articles in flight use one budget"""
+    load_environment()
+    return RateLimiter(
+        requests_per_minute=int(os.getenv('API_REQUESTS_PER_MINUTE', '500')),
+        tokens_per_minute=int(os.getenv('API_TOKENS_PER_MINUTE', '200000')))
+
+
+@lru_cache(maxsize=None)
+def get_encoder(model=MODEL):
+    """Load the tokenizer once per model instead of on every call"""
+    import tiktoken
+    return tiktoken.encoding_for_model(model)
+
+
+def count_tokens(text):
+    return len(get_encoder().encode(text))
+
+
+def final_instructions():
+    return f'From a christian perspective, summarize the following article in {SUMMARY_SIZE} words. Also provide {SUMMARY_TAGS} tags to use at the end of the summary:\n\n'
+
+
+def summary_tags(summary):
+    """The tags listed at the end of a final summary, e.g. after "Tags:", or [] if there are none.
+
+    They may follow the heading on the same line, separated by commas or
+    hashes, or be a list on the lines below it.
+    """
+    lines = (summary or '').splitlines()
+    for index in range(len(lines) - 1, -1, -1):
+        match = TAGS_HEADING.match(lines[index].strip())
+        if match:
+            items = [match.group(1) or ''] + lines[index + 1:]
+            break
+    else:
+        return []
+
+    tags = []
+    for item in items:
+        for tag in re.split(r'[,;#]', item):
+            # Drop list bullets, numbering, quotes and markdown emphasis
+            tag = re.sub(r'^\s*(?:[-*\u2022]|\d+[.)])\s*', '', tag).strip(' \t"\'*_.`')
+            if tag and tag.lower() not in (known.lower() for known in tags):
+                tags.append(tag)
+    return tags[:SUMMARY_TAGS]
+
+
+def input_budget(instructions=''):
+    """Tokens of article text that fit in one request next to the prompt and the reply"""
+    context = MODEL_CONTEXT_TOKENS.get(MODEL, DEFAULT_CONTEXT_TOKENS)
+    overhead = count_tokens(SYSTEM_PROMPT) + count_tokens(instructions) + 2 * MESSAGE_OVERHEAD_TOKENS
+    return min(MAX_INPUT_TOKENS, context - RESPONSE_TOKENS - overhead)
+
+
+def chunk_size(total_tokens, limit):
+    """Even chunk size for total_tokens so no chunk is larger than limit"""
+    chunk_count = math.ceil(total_tokens / limit)
+    # A little slack so sentence boundaries don't spill into an extra chunk
+    return min(limit, math.ceil(total_tokens / chunk_count * 1.05))
+
+
+def is_retryable(error):
+    from openai import APIConnectionError, APIStatusError, APITimeoutError
+    if isinstance(error, (APIConnectionError, APITimeoutError)):
+        return True
+    return isinstance(error, APIStatusError) and (
+        error.status_code == 429 or error.status_code >= 500)
+
+
+def retry_after(error):
+    """Seconds the server asked us to wait, if it said so"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
 class AISummarize():
+    """Summaries through the chat API; set_status is called from worker threads and must not block"""
+
     def __init__(self, set_status):
-        load_dotenv()
-        api_key = os.getenv('API_KEY')
-        self.client = OpenAI(api_key=api_key)
         self.set_status = set_status
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        """OpenAI client, created on first use so the window opens without it"""
+        with self._client_lock:
+            if self._client is None:
+                from openai import OpenAI
+                load_environment()
+                api_key = os.getenv('API_KEY')
+                # API_BASE_URL points the client at any OpenAI-compatible server, e.g. a local fake
+                # Retries are handled here so they share the rate limiter
+                self._client = OpenAI(api_key=api_key, base_url=os.getenv('API_BASE_URL') or None,
+                                      max_retries=0)
+            return self._client
 
     def build_ocr_pdf(self, pdf_path):
         # Ensure the provided path is absolute
@@ -43,62 +194,149 @@ class AISummarize():
             shutil.move(ocr_pdf_path, pdf_path)
             
             self.set_status(f"Successfully replaced {pdf_path} with OCR version.")
-            time.sleep(2)
         
         except subprocess.CalledProcessError as e:
             self.set_status(f"Error running NAPS2: {e}")
-            time.sleep(10)
         
         except Exception as e:
             self.set_status(f"Unexpected error: {e}")
-            time.sleep(10)
 
-    def  extract_text_from_pdf(self, pdf_path):
-        with open(pdf_path, 'rb') as pdf_file:
-            reader = PyPDF2.PdfReader(pdf_file)
-            text = ''
-            for page in reader.pages:
-                text += page.extract_text()
-        return text
+    def extract_pages_from_pdf(self, pdf_path):
+        """Return the text of every page using PyMuPDF"""
+        import fitz  # PyMuPDF
+        with Metrics.span('extract_text') as info, fitz.open(pdf_path) as document:
+            info['pages'] = len(document)
+            return [page.get_text() for page in document]
+
+    def extract_text_from_pdf(self, pdf_path):
+        return '\n'.join(self.extract_pages_from_pdf(pdf_path))
+
+    def iter_chunks(self, pages_text, max_tokens):
+        """Yield chunks of at most max_tokens, cut at sentence ends, reading one page at a time"""
+        encoder = get_encoder()
+        chunk = []
+        chunk_tokens = 0
+
+        for page_text in pages_text:
+            for sentence in SENTENCE_BREAK.split(page_text):
+                sentence = sentence.strip()
+                if not sentence:
+                    continue
+                tokens = encoder.encode(sentence)
+
+                if chunk and chunk_tokens + len(tokens) > max_tokens:
+                    yield ' '.join(chunk)
+                    chunk = []
+                    chunk_tokens = 0
+
+                # A single sentence longer than a chunk has to be cut by tokens
+                while len(tokens) > max_tokens:
+                    yield encoder.decode(tokens[:max_tokens])
+                    tokens = tokens[max_tokens:]
+                    sentence = encoder.decode(tokens)
 
-    def split_text(self, text, max_tokens=2000):
-        encoder = tiktoken.encoding_for_model(MODEL)  # Use the model you are working with
-        tokens = encoder.encode(text)
+                chunk.append(sentence)
+                chunk_tokens += len(tokens)
 
-        chunks = []
-        start = 0
+        if chunk:
+            yield ' '.join(chunk)
 
-        while start < len(tokens):
-            end = start + max_tokens
-            chunk_tokens = tokens[start:end]
-            chunk_text = encoder.decode(chunk_tokens)
-            chunks.append(chunk_text)
-            start = end
+    def split_text(self, text, max_tokens=MAX_INPUT_TOKENS):
+        return list(self.iter_chunks([text], max_tokens))
 
-        return chunks
+    def create_completion(self, messages, max_tokens):
+        """Call the chat API within the shared rate limit, retrying 429s and 5xx errors.
+
+        Replies are cached on disk by model, max_tokens and the exact prompt text,
+        so a re-run only pays for requests whose input changed.
+        """
+        cache_key = DiskCache.key(MODEL, max_tokens,
+                                  *(f'{m["role"]}:{m["content"]}' for m in messages))
+        cached = summary_cache.get_text(cache_key)
+        if cached is not None:
+            Metrics.record('api_cache_hit', 0.0)
+            return cached
+
+        content = self._request_completion(messages, max_tokens)
+        if content:
+            summary_cache.put_text(cache_key, content)
+        return content
+
+    def _request_completion(self, messages, max_tokens):
+        # Rough prompt size estimate (~4 characters per token) plus the reserved reply
+        estimated_tokens = sum(len(message["content"]) for message in messages) // 4 + max_tokens
+
+        rate_limiter = get_rate_limiter()
+        for attempt in range(MAX_RETRIES + 1):
+            with Metrics.span('rate_limit_wait'):
+                rate_limiter.acquire(estimated_tokens)
+            try:
+                with Metrics.span('api_call', model=MODEL, attempt=attempt + 1) as info:
+                    response = self.client.chat.completions.create(model=MODEL,
+                        messages=messages,
+                        max_tokens=max_tokens)
+                    if response.usage:
+                        info['prompt_tokens'] = response.usage.prompt_tokens
+                        info['completion_tokens'] = response.usage.completion_tokens
+                return response.choices[0].message.content
+            except Exception as e:
+                if attempt == MAX_RETRIES or not is_retryable(e):
+                    raise
+
+                # Exponential backoff with jitter, or what the server asked for
+                delay = retry_after(e) or min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
+                delay += random.uniform(0, delay / 4)
+                if getattr(e, 'status_code', None) == 429:
+                    # Everyone sharing the limiter backs off, not just this thread
+                    rate_limiter.penalize(delay)
+                time.sleep(delay)
+
+    def summarize_chunk(self, chunk):
+        return self.create_completion(
+            [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": chunk},
+            ],
+            max_tokens=RESPONSE_TOKENS)  # Allocate tokens for the response
 
     def summarize_chunks(self, chunks):
+        """Summarize chunks concurrently, keeping their order.
 
+        chunks may be a generator; only a few chunks are read ahead of the
+        requests in flight so long articles are never held in memory at once.
+        """
         summaries = []
-        for chunk in chunks:
-            response = self.client.chat.completions.create(model=MODEL,
-                messages=[
-                    {"role": "system", "content": "You are an assistant that summarizes text."},
-                    {"role": "user", "content": chunk},
-                ],
-                max_tokens=500) # Allocate tokens for the response)
-            summaries.append(response.choices[0].message.content)
+        pending = []
+        with ThreadPoolExecutor(max_workers=CHUNK_WORKERS) as executor:
+            for chunk in chunks:
+                # Each request runs in a copy of our context so its metrics keep the article
+                pending.append(executor.submit(
+                    contextvars.copy_context().run, self.summarize_chunk, chunk))
+                if len(pending) >= CHUNK_WORKERS * 2:
+                    summaries.append(pending.pop(0).result())
+            summaries.extend(future.result() for future in pending)
+        return summaries
+
+    def reduce_summaries(self, summaries, max_tokens):
+        """Merge summaries in tiers until together they fit in one final prompt"""
+        while len(summaries) > 1 and sum(count_tokens(s) for s in summaries) > max_tokens:
+            # Each group of neighbouring summaries becomes one chunk of the next tier
+            groups = self.iter_chunks(summaries, max_tokens)
+            merged = self.summarize_chunks(groups)
+            if len(merged) >= len(summaries):
+                # Summaries are not getting shorter, stop rather than loop forever
+                return merged
+            summaries = merged
         return summaries
 
     def generate_final_summary(self, summaries):
         concatenated_summary = " ".join(summaries)
-        response = self.client.chat.completions.create(model=MODEL,
-            messages=[
-                {"role": "system", "content": "You are an assistant that summarizes text."},
-                {"role": "user", "content": f'From a christian perspective, summarize the following article in {SUMMARY_SIZE} words. Also provide 5 tags to use at the end of the summary:\n\n{concatenated_summary}'},
+        return self.create_completion(
+            [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": final_instructions() + concatenated_summary},
             ],
-            max_tokens=500)  # Allocate tokens for the response)
-        return response.choices[0].message.content
+            max_tokens=RESPONSE_TOKENS)  # Allocate tokens for the response
 
     def save_summary_to_file(self, pdf_path, summary):
         # Create the output file name by replacing .pdf with .txt
@@ -106,26 +344,44 @@ class AISummarize():
         with open(output_file, 'w') as file:
             file.write(summary)
         self.set_status(f'Summary complete ({output_file})')
-        time.sleep(2)
 
-    def summarize(self, pdf_path: str):
-        # Extract text from the PDF
-        text = self.extract_text_from_pdf(pdf_path)
-        if text == '':
+    def summarize(self, pdf_path: str, pages_text=None):
+        """Summarize an article, save the summary next to its PDF and return it.
+
+        pages_text is the per-page text already produced while splitting the
+        article (OCR or text layer). The PDF is only read when it is not given.
+        """
+        if pages_text is None:
+            pages_text = self.extract_pages_from_pdf(pdf_path)
+
+        if not any(page_text.strip() for page_text in pages_text):
             self.build_ocr_pdf(pdf_path)
-            text = self.extract_text_from_pdf(pdf_path)
+            pages_text = self.extract_pages_from_pdf(pdf_path)
+
+        with Metrics.span('tokenize') as info:
+            total_tokens = sum(count_tokens(page_text) for page_text in pages_text)
+            info['tokens'] = total_tokens
+        final_budget = input_budget(final_instructions())
+
+        if total_tokens <= final_budget:
+            # The whole article fits in one request, summarize it directly
+            final_summary = self.generate_final_summary(['\n'.join(pages_text)])
+        else:
+            # Step 1: Split the text into evenly sized chunks, page by page
+            chunks = self.iter_chunks(pages_text, chunk_size(total_tokens, input_budget()))
 
-        # Step 1: Split the text into chunks
-        chunks = self.split_text(text, max_tokens=2000)
+            # Step 2: Summarize each chunk
+            chunk_summaries = self.summarize_chunks(chunks)
 
-        # Step 2: Summarize each chunk
-        chunk_summaries = self.summarize_chunks(chunks)
+            # Step 3: Merge the chunk summaries until they fit in one prompt
+            chunk_summaries = self.reduce_summaries(chunk_summaries, final_budget)
 
-        # Step 3: Generate a final summary
-        final_summary = self.generate_final_summary(chunk_summaries)
+            # Step 4: Generate a final summary
+            final_summary = self.generate_final_summary(chunk_summaries)
         if (final_summary == ''):
             self.set_status(f'Unable to generate a summary for {pdf_path}')
 
         # Save the summary to a text file
         output_path = pdf_path.replace('.pdf', '.txt')
         self.save_summary_to_file(output_path, final_summary)
+        return final_summary
@@ -0,0 +1,424 @@
+"""Reproducible benchmarks for rendering, splitting, OCR and summarizing.
+
+Usage:
+    python benchmarks/bench.py
+    python benchmarks/bench.py --pages 10,100,500 --kinds text,scanned,mixed --output after.json
+    python benchmarks/bench.py --compare before.json --output after.json
+
+Synthetic magazine PDFs are generated with PyMuPDF from a fixed seed, so
+runs on the same machine are comparable. Results are written as JSON; with
+--compare, each result is printed next to the matching one from an earlier
+run. OCR benchmarks are skipped when tesseract is not installed.
+Summaries go to a local mock OpenAI server with injected latency.
+"""
+import argparse
+import difflib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+PAGE_WIDTH = 595   # A4 in points
+PAGE_HEIGHT = 842
+WORDS = ("church faith community editor issue magazine grace report letter story "
+         "season mission people family history parish review music young service").split()
+
+# Pages of each article when splitting a synthetic issue
+ARTICLE_PAGES = 8
+
+
+def paragraph(rng, words):
+    sentences = []
+    while words > 0:
+        length = min(words, rng.randint(8, 20))
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(length))
+        sentences.append(sentence.capitalize() + '.')
+        words -= length
+    return ' '.join(sentences)
+
+
+def add_text_page(doc, rng, index):
+    import fitz  # PyMuPDF
+    page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+    page.insert_text((50, 70), f"Headline number {index}", fontsize=26)
+    page.insert_text((50, 95), "By A. Writer", fontsize=11)
+    page.insert_textbox(fitz.Rect(50, 110, PAGE_WIDTH - 50, PAGE_HEIGHT - 50),
+                        paragraph(rng, 450), fontsize=10)
+
+
+def add_scanned_page(doc, rng, index):
+    """A page of text that only exists as an image, like a scan"""
+    import fitz  # PyMuPDF
+    source = fitz.open()
+    add_text_page(source, rng, index)
+    pix = source[0].get_pixmap(dpi=150, colorspace=fitz.csGRAY)
+    page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+    page.insert_image(page.rect, pixmap=pix)
+    source.close()
+
+
+def add_photo_page(doc, rng, index):
+    """A full-page picture without text, like an advert"""
+    import fitz  # PyMuPDF
+    import numpy as np
+    width, height = 620, 880
+    generator = np.random.default_rng(rng.randint(0, 2**31))
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 / width, y * 255 / height, (x + y) * 127 / (width + height)], axis=-1)
+    noise = generator.normal(0, 12, base.shape)
+    samples = np.clip(base + noise, 0, 255).astype(np.uint8).tobytes()
+    pix = fitz.Pixmap(fitz.csRGB, width, height, samples, False)
+    page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+    page.insert_image(page.rect, pixmap=pix)
+
+
+def make_issue(path, kind, pages, seed=0):
+    """Write a synthetic issue of the given kind: text, scanned or mixed"""
+    import fitz  # PyMuPDF
+    rng = random.Random(f"{seed}-{kind}-{pages}")
+    mixed = (add_text_page, add_text_page, add_scanned_page, add_photo_page)
+    doc = fitz.open()
+    for index in range(pages):
+        if kind == 'text':
+            add_text_page(doc, rng, index)
+        elif kind == 'scanned':
+            add_scanned_page(doc, rng, index)
+        else:
+            mixed[index % len(mixed)](doc, rng, index)
+    doc.save(path, garbage=3, deflate=True)
+    doc.close()
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def result(name, kind, pages, seconds, units=None, **extra):
+    units = pages if units is None else units
+    entry = {
+        "name": name,
+        "kind": kind,
+        "pages": pages,
+        "seconds": round(seconds, 4),
+        "per_second": round(units / seconds, 3) if seconds > 0 else None,
+    }
+    entry.update(extra)
+    return entry
+
+
+def bench_render(path, kind, pages, width=800, height=1000):
+    """update_page_display-equivalent rendering, cold and from the page cache"""
+    from PageCache import PageCache
+    from DocumentService import DocumentService, LocalDocument
+
+    results = []
+    for name, document in (("render", LocalDocument(path)),
+                           ("render_service", DocumentService(path))):
+        cache = PageCache()
+
+        def render_all():
+            for index in range(len(document)):
+                img = cache.get(index, width, height)
+                if img is None:
+                    cache.put(index, width, height, document.render(index, width, height))
+
+        try:
+            cold, _ = timed(render_all)
+            warm, _ = timed(render_all)
+        finally:
+            document.close()
+        results += [result(name, kind, pages, cold, width=width, height=height),
+                    result(name + "_cached", kind, pages, warm, width=width, height=height)]
+    return results
+
+
+def bench_split(path, kind, pages, work_dir):
+    """Split the issue into ARTICLE_PAGES-page articles without OCR"""
+    from ArticleProcessor import ArticleProcessor, make_job
+
+    processor = ArticleProcessor(lambda message: None, None, None)
+    ranges = [(start, min(start + ARTICLE_PAGES - 1, pages))
+              for start in range(1, pages + 1, ARTICLE_PAGES)]
+
+    def split_all():
+        for article_id, (start, end) in enumerate(ranges):
+            data = {"name": f"article {article_id}", "start": start, "end": end}
+            processor.split_article(make_job(article_id, data, path, work_dir, False))
+
+    seconds, _ = timed(split_all)
+    processor.close_source(path)
+    return [result("split", kind, pages, seconds, articles=len(ranges))]
+
+
+def bench_save(path, kind, pages, work_dir):
+    """Plain and optimized saves of every ARTICLE_PAGES-page article: time and bytes written"""
+    from ArticleProcessor import save_pdf
+    from DocumentService import LocalDocument
+
+    document = LocalDocument(path)
+    ranges = [(start, min(start + ARTICLE_PAGES, pages) - 1) for start in range(0, pages, ARTICLE_PAGES)]
+
+    def save_all(optimize):
+        written = 0
+        for number, (start, end) in enumerate(ranges):
+            article, _ = document.extract(start, end)
+            written += save_pdf(article, os.path.join(work_dir, f"save-{number}.pdf"), optimize)['bytes']
+            article.close()
+        return written
+
+    try:
+        results = []
+        for name, optimize in (("save_plain", False), ("save_optimized", True)):
+            seconds, written = timed(lambda: save_all(optimize))
+            results.append(result(name, kind, pages, seconds, articles=len(ranges), bytes=written))
+    finally:
+        document.close()
+    return results
+
+
+def bench_index(path, kind, pages):
+    """Page feature indexing on open, then proposing articles from the cached features"""
+    from DocumentService import LocalDocument
+    from PageIndex import index_document, propose_articles
+
+    document = LocalDocument(path)
+    try:
+        cold, features = timed(lambda: index_document(path, document))
+        cached, articles = timed(lambda: propose_articles(index_document(path, document)))
+    finally:
+        document.close()
+    return [result("index", kind, pages, cold),
+            result("propose_cached", kind, pages, cached, articles=len(articles))]
+
+
+def bench_ocr(path, kind, pages, work_dir, ocr_pages):
+    """Single page perform_ocr, then the parallel add_ocr_layer path with each OCR engine"""
+    import fitz  # PyMuPDF
+    import OCR
+    from ArticleProcessor import ArticleProcessor
+    from DiskCache import DiskCache
+
+    count = min(pages, ocr_pages)
+    results = []
+    with fitz.open(path) as doc:
+        def ocr_serial():
+            for index in range(count):
+                OCR._recognize(doc[index], OCR.OCR_DPI, OCR.OCR_LANG)
+
+        seconds, _ = timed(ocr_serial)
+        results.append(result("perform_ocr", kind, count, seconds))
+
+    def article():
+        article = fitz.open()
+        with fitz.open(path) as doc:
+            article.insert_pdf(doc, from_page=0, to_page=count - 1)
+        return article
+
+    output_path = os.path.join(work_dir, f"ocr-{kind}-{pages}.pdf")
+    for engine, name in ((OCR.ENGINE_PAGE, "add_ocr_layer_page"), (OCR.ENGINE_BATCH, "add_ocr_layer")):
+        # Every engine starts from an empty OCR cache of its own
+        OCR.ocr_cache = DiskCache(f'ocr-{engine}')
+        pool = OCR.OcrPool(engine=engine)
+        processor = ArticleProcessor(lambda message: None, pool, None)
+        try:
+            seconds, _ = timed(lambda: processor.add_ocr_layer(article(), output_path, path, range(count)))
+            results.append(result(name, kind, count, seconds, processes=pool.workers, engine=engine))
+
+            if engine == OCR.ENGINE_BATCH:
+                # Same pages again, now served from the OCR cache
+                seconds, _ = timed(lambda: processor.add_ocr_layer(article(), output_path, path, range(count)))
+                results.append(result("add_ocr_layer_cached", kind, count, seconds))
+        finally:
+            pool.shutdown()
+    return results
+
+
+def bench_summarize(path, kind, pages, latency):
+    """AISummarize against the mock server, first cold and then from the summary cache"""
+    import fitz  # PyMuPDF
+    from mock_openai import MockOpenAIServer
+
+    server = MockOpenAIServer(latency=latency).start()
+    os.environ['API_BASE_URL'] = server.base_url
+    os.environ.setdefault('API_KEY', 'benchmark')
+    try:
+        from Summarize import AISummarize
+        with fitz.open(path) as doc:
+            pages_text = [page.get_text() for page in doc]
+
+        summarizer = AISummarize(lambda text: None)
+        cold, _ = timed(lambda: summarizer.summarize(path, pages_text))
+        cold_requests = server.requests
+        warm, _ = timed(lambda: summarizer.summarize(path, pages_text))
+    finally:
+        server.stop()
+    return [result("summarize", kind, pages, cold, requests=cold_requests, latency=latency),
+            result("summarize_cached", kind, pages, warm,
+                   requests=server.requests - cold_requests, latency=latency)]
+
+
+def make_ocr_sample(rng, index):
+    """A scanned page with known text: slightly skewed, on tinted paper half of the time"""
+    import fitz  # PyMuPDF
+    import numpy as np
+    from PIL import Image
+
+    source = fitz.open()
+    add_text_page(source, rng, index)
+    truth = source[0].get_text()
+    pix = source[0].get_pixmap(dpi=200, colorspace=fitz.csGRAY)
+    source.close()
+
+    scan = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+    scan = scan.rotate(rng.uniform(-2.0, 2.0), resample=Image.BILINEAR, fillcolor=255)
+    pixels = np.asarray(scan, dtype=np.float32)[..., None]
+    tint = np.array([1.0, 0.92, 0.78] if index % 2 else [1.0, 1.0, 1.0], dtype=np.float32)
+    scan = Image.fromarray((pixels * tint).astype(np.uint8))
+
+    buffer = io.BytesIO()
+    scan.save(buffer, 'PNG')
+    doc = fitz.open()
+    page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+    page.insert_image(page.rect, stream=buffer.getvalue())
+    return doc, truth
+
+
+def character_accuracy(truth, text):
+    """Similarity of the recognized characters to the real ones, whitespace ignored, 0..1"""
+    truth, text = ' '.join(truth.split()), ' '.join(text.split())
+    return difflib.SequenceMatcher(None, truth, text, autojunk=False).ratio()
+
+
+def bench_ocr_quality(count, seed):
+    """Pages per second and character accuracy: 300 dpi RGB against the adaptive grayscale render"""
+    import fitz  # PyMuPDF
+    from PIL import Image
+    import pytesseract
+    import OCR
+
+    def rgb_300(page):
+        # The OCR path before adaptive DPI and preprocessing
+        pix = page.get_pixmap(matrix=fitz.Matrix(300 / 72, 300 / 72))
+        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        return pytesseract.image_to_string(img, lang=OCR.OCR_LANG)
+
+    rng = random.Random(f"{seed}-ocr-quality")
+    samples = [make_ocr_sample(rng, index) for index in range(count)]
+
+    results = []
+    for name, recognize in (("ocr_rgb300", rgb_300),
+                            ("ocr_adaptive", lambda page: OCR._recognize(page, None, OCR.OCR_LANG)[0])):
+        seconds, texts = timed(lambda: [recognize(doc[0]) for doc, _ in samples])
+        accuracy = sum(character_accuracy(truth, text)
+                       for (_, truth), text in zip(samples, texts)) / count
+        results.append(result(name, "ocr_sample", count, seconds, accuracy=round(accuracy, 4)))
+    for doc, _ in samples:
+        doc.close()
+    return results
+
+
+def compare(results, previous_path):
+    with open(previous_path) as file:
+        previous = {(r["name"], r["kind"], r["pages"]): r for r in json.load(file)["results"]}
+
+    print(f"\n{'benchmark':<24}{'kind':<9}{'pages':>6}{'before':>10}{'after':>10}{'change':>9}")
+    for entry in results:
+        before = previous.get((entry["name"], entry["kind"], entry["pages"]))
+        if not before:
+            continue
+        change = (entry["seconds"] - before["seconds"]) / before["seconds"] * 100 if before["seconds"] else 0
+        print(f"{entry['name']:<24}{entry['kind']:<9}{entry['pages']:>6}"
+              f"{before['seconds']:>9.3f}s{entry['seconds']:>9.3f}s{change:>+8.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark rendering, splitting, OCR and summarizing.")
+    parser.add_argument('--pages', default='10,100', help="Comma separated issue sizes (10-500 pages)")
+    parser.add_argument('--kinds', default='text,scanned,mixed', help="Comma separated: text, scanned, mixed")
+    parser.add_argument('--only', default='render,split,save,index,ocr,summarize',
+                        help="Comma separated benchmarks to run")
+    parser.add_argument('--ocr-pages', type=int, default=12, help="Pages per issue to OCR")
+    parser.add_argument('--latency', type=float, default=0.3, help="Mock API latency in seconds")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_output.json', help="Where to write the JSON results")
+    parser.add_argument('--compare', help="Earlier results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.pages.split(',')]
+    kinds = args.kinds.split(',')
+    only = set(args.only.split(','))
+    if any(size < 1 or size > 500 for size in sizes):
+        parser.error("issue sizes must be between 1 and 500 pages")
+
+    work_dir = tempfile.mkdtemp(prefix='magazine-bench-')
+    # Keep the persistent caches out of the way so every run starts cold
+    os.environ['MAGAZINE_SPLITTER_CACHE'] = os.path.join(work_dir, 'cache')
+
+    results = []
+    try:
+        for kind in kinds:
+            for pages in sizes:
+                path = os.path.join(work_dir, f"{kind}-{pages}.pdf")
+                seconds, _ = timed(lambda: make_issue(path, kind, pages, args.seed))
+                print(f"Generated {kind} issue with {pages} pages in {seconds:.2f}s")
+
+                if 'render' in only:
+                    results.extend(bench_render(path, kind, pages))
+                if 'split' in only:
+                    results.extend(bench_split(path, kind, pages, work_dir))
+                if 'save' in only:
+                    results.extend(bench_save(path, kind, pages, work_dir))
+                if 'index' in only:
+                    results.extend(bench_index(path, kind, pages))
+                if 'ocr' in only:
+                    if shutil.which('tesseract'):
+                        results.extend(bench_ocr(path, kind, pages, work_dir, args.ocr_pages))
+                    else:
+                        print("Skipping OCR: tesseract is not installed")
+                if 'summarize' in only and kind != 'scanned':
+                    results.extend(bench_summarize(path, kind, pages, args.latency))
+
+                for entry in results:
+                    if entry["kind"] == kind and entry["pages"] == pages:
+                        print(f"  {entry['name']:<22}{entry['seconds']:>9.3f}s")
+
+        if 'ocr' in only and shutil.which('tesseract'):
+            for entry in bench_ocr_quality(args.ocr_pages, args.seed):
+                results.append(entry)
+                print(f"  {entry['name']:<22}{entry['per_second']:>9.3f} pages/s"
+                      f"  accuracy {entry['accuracy']:.1%}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "created": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
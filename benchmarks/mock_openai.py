@@ -0,0 +1,123 @@
+"""A local stand-in for the OpenAI chat completions API.
+
+Usage:
+    python benchmarks/mock_openai.py --port 8000 --latency 0.5 --error-rate 0.1
+
+Then point the summarizer at it with API_BASE_URL=http://127.0.0.1:8000/v1.
+Every reply waits for the injected latency, and a share of requests can be
+answered with 429 or 500 to exercise the retry path.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockOpenAIServer():
+    """Serve /v1/chat/completions on a background thread"""
+
+    def __init__(self, port=0, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body, headers=None):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length) or b'{}')
+                time.sleep(mock.latency)
+
+                with mock._lock:
+                    mock.requests += 1
+                    fail = mock._random.random() < mock.error_rate
+                    if fail:
+                        mock.errors += 1
+                        status = mock._random.choice((429, 500))
+
+                if not self.path.endswith('/chat/completions'):
+                    self._reply(404, {"error": {"message": "not found"}})
+                    return
+                if fail:
+                    self._reply(status, {"error": {"message": "injected failure", "type": "mock"}},
+                                {'Retry-After': '0.1'} if status == 429 else None)
+                    return
+
+                prompt = ' '.join(message.get('content', '') for message in request.get('messages', []))
+                prompt_tokens = len(prompt) // 4
+                content = f"Summary of {len(prompt.split())} words: " + ' '.join(prompt.split()[:40])
+                completion_tokens = len(content) // 4
+                self._reply(200, {
+                    "id": f"chatcmpl-mock-{mock.requests}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get('model', 'mock'),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                    },
+                })
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a fake OpenAI-compatible chat API.")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.5, help="Seconds before every reply")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests answered with 429/500")
+    args = parser.parse_args(argv)
+
+    server = MockOpenAIServer(args.port, args.latency, args.error_rate).start()
+    print(f"Mock OpenAI API on {server.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
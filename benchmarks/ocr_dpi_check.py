@@ -0,0 +1,116 @@
+"""Check the resolution OCR picks for text of known sizes.
+
+Usage:
+    python benchmarks/ocr_dpi_check.py
+
+Pages of body text are generated with PyMuPDF in several typefaces, sizes
+and line spacings, plus scanned and skewed copies of some of them, and
+OCR.prepare_ocr_image has to pick a DPI inside the range expected for each
+size: 300 dpi or less for body text, more only for small print and less for
+display type. Pages without text lines keep the default. It exits with
+status 1 when a DPI is out of range. Tesseract is not needed.
+"""
+import argparse
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import OCR  # noqa: E402
+from bench import PAGE_HEIGHT, PAGE_WIDTH, add_photo_page, paragraph  # noqa: E402
+
+FONTS = ('helv', 'tiro', 'cour')
+LINE_HEIGHTS = (None, 1.2)  # PyMuPDF's own spacing of the font, and tight leading
+
+# Font size in points -> lowest and highest acceptable DPI
+EXPECTED_DPI = {
+    6: (325, OCR.MAX_OCR_DPI),
+    8: (300, 325),
+    9: (300, 300),
+    10: (300, 300),
+    11: (300, 300),
+    12: (275, 300),
+    18: (175, 275),
+    24: (OCR.MIN_OCR_DPI, 200),
+    36: (OCR.MIN_OCR_DPI, OCR.MIN_OCR_DPI),
+}
+
+# Sizes also checked as a skewed grayscale scan
+SCANNED_SIZES = (8, 10, 24)
+SCAN_DPI = 200
+SCAN_DEGREES = 2.0
+
+
+def text_page(font, size, line_height, seed=0):
+    """A page filled with as much body text as fits"""
+    import fitz  # PyMuPDF
+
+    text = paragraph(random.Random(f"{seed}-{font}-{size}"), 2000)
+    box = fitz.Rect(50, 50, PAGE_WIDTH - 50, PAGE_HEIGHT - 50)
+    while True:
+        doc = fitz.open()
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        if page.insert_textbox(box, text, fontsize=size, fontname=font, lineheight=line_height) >= 0:
+            return doc
+        doc.close()
+        text = text[:int(len(text) * 0.8)]
+
+
+def scanned(source):
+    """The first page of source as a slightly rotated grayscale image"""
+    import fitz  # PyMuPDF
+    from PIL import Image
+
+    pix = source[0].get_pixmap(dpi=SCAN_DPI, colorspace=fitz.csGRAY)
+    scan = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+    scan = scan.rotate(SCAN_DEGREES, resample=Image.BILINEAR, fillcolor=255)
+    doc = fitz.open()
+    page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+    page.insert_image(page.rect, pixmap=fitz.Pixmap(fitz.csGRAY, scan.width, scan.height,
+                                                    scan.tobytes(), False))
+    return doc
+
+
+def check(name, doc, low, high, failures):
+    dpi = OCR.prepare_ocr_image(doc[0])[1]
+    ok = low <= dpi <= high
+    print(f"{name:<28} {dpi:>4} dpi  (expected {low}-{high}){'' if ok else '  FAIL'}")
+    if not ok:
+        failures.append(f"{name} got {dpi} dpi, expected {low}-{high}")
+    doc.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the OCR resolution chosen for known text sizes.")
+    parser.parse_args(argv)
+
+    import fitz  # PyMuPDF
+
+    failures = []
+    for font in FONTS:
+        for line_height in LINE_HEIGHTS:
+            spacing = f"x{line_height}" if line_height else "default"
+            for size, (low, high) in EXPECTED_DPI.items():
+                doc = text_page(font, size, line_height)
+                if line_height is None and size in SCANNED_SIZES:
+                    check(f"{font} {size}pt {spacing} scanned", scanned(doc), low, high, failures)
+                check(f"{font} {size}pt {spacing}", doc, low, high, failures)
+
+    doc = fitz.open()
+    add_photo_page(doc, random.Random(0), 0)
+    check("photo", doc, OCR.DEFAULT_OCR_DPI, OCR.DEFAULT_OCR_DPI, failures)
+
+    doc = fitz.open()
+    doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT).insert_text((50, 100), "A lone headline", fontsize=30)
+    check("lone headline", doc, OCR.DEFAULT_OCR_DPI, OCR.DEFAULT_OCR_DPI, failures)
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
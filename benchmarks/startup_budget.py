@@ -0,0 +1,92 @@
+"""Check that MagazineSplitter still starts within its time budget.
+
+Usage:
+    python benchmarks/startup_budget.py
+    python benchmarks/startup_budget.py --repeat 7 --budget benchmarks/startup_budget.json
+    python benchmarks/startup_budget.py --no-window
+
+Every measurement runs in a fresh interpreter. It reports the time to import
+MagazineSplitter.py and the time until the first window has been drawn, plus
+any heavy modules that got imported on the way. It exits with status 1 when a
+time is over budget or a module that should load lazily was imported.
+Without a display the time to first window can't be measured, which also
+fails unless --no-window says to check the import alone.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BUDGET = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_budget.json')
+
+# Runs in the child interpreter and prints one JSON line
+PROBE = r'''
+import json, sys, time
+start = time.perf_counter()
+import MagazineSplitter
+imported = time.perf_counter()
+result = {
+    "import_seconds": imported - start,
+    "heavy_modules": sorted(name for name in HEAVY_MODULES if name in sys.modules),
+}
+try:
+    app = MagazineSplitter.MagazineSplitter()
+    app.update()
+    result["first_window_seconds"] = time.perf_counter() - start
+    result["heavy_modules"] = sorted(name for name in HEAVY_MODULES if name in sys.modules)
+    app.destroy()
+except MagazineSplitter.tk.TclError:
+    pass  # No display to open a window on
+print(json.dumps(result))
+'''
+
+
+def measure_once(heavy_modules):
+    code = f"HEAVY_MODULES = {heavy_modules!r}\n" + PROBE
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure startup time against a budget.")
+    parser.add_argument('--budget', default=DEFAULT_BUDGET, help="Budget JSON file")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs to take the median of")
+    parser.add_argument('--no-window', action='store_true',
+                        help="Only check the import, e.g. on a machine without a display")
+    args = parser.parse_args(argv)
+
+    with open(args.budget) as file:
+        budget = json.load(file)
+
+    runs = [measure_once(budget['lazy_modules']) for _ in range(args.repeat)]
+
+    failures = []
+    metrics = ('import_seconds',) if args.no_window else ('import_seconds', 'first_window_seconds')
+    for metric in metrics:
+        values = [run[metric] for run in runs if metric in run]
+        if not values:
+            print(f"{metric}: not measured, no display")
+            failures.append(f"{metric} could not be measured without a display, "
+                            f"run with a display (e.g. xvfb-run) or pass --no-window")
+            continue
+        median = statistics.median(values)
+        limit = budget[metric]
+        print(f"{metric}: {median:.3f}s (budget {limit:.3f}s)")
+        if median > limit:
+            failures.append(f"{metric} {median:.3f}s is over the {limit:.3f}s budget")
+
+    loaded = sorted({name for run in runs for name in run['heavy_modules']})
+    if loaded:
+        failures.append(f"imported at startup but should load lazily: {', '.join(loaded)}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())